@@ -24,7 +24,7 @@ import os
 from pathlib import Path
 
 from fenics import *
-from fenics_ice import model, config
+from fenics_ice import model, config, inout
 from fenics_ice import mesh as fice_mesh
 
 
@@ -81,17 +81,16 @@ for i, rf in enumerate(run_folders):
     else:
         Qp = fice_mesh.get_periodic_space(params, mesh, dim=1)
 
-    eigenfunc = Function(Qp)
-
     x    = mesh.coordinates()[:,0]
     y    = mesh.coordinates()[:,1]
     t    = mesh.cells()
 
+    vr_file = str(next((run_dir / 'output').glob("*vr.h5")))
+    eigenfuncs = inout.MultiVectorFile(vr_file, Qp).read_functions(
+        slice(e_offset, e_offset + 4))
+
     for j in range(4):
-        k = j + e_offset
-        vr_file = str(next((run_dir / 'output').glob("*vr.h5")))
-        hdf5data = HDF5File(MPI.comm_world, vr_file, 'r')
-        hdf5data.read(eigenfunc, f'v/vector_{k}')
+        eigenfunc = eigenfuncs[j]
 
         sind = j+1+i*4
         ax  = fig.add_subplot(2,4,sind)
@@ -87,6 +87,43 @@ class ConfigParser(object):
             self.bcs = []
             pass
 
+        # Boundary markers are specific to a mesh, so multilevel inversions
+        # need one file per coarse mesh
+        coarse_meshes = self.inversion.coarse_meshes or []
+        coarse_bc_files = self.inversion.coarse_bc_files or []
+        if self.mesh.bc_filename is not None:
+            assert len(coarse_bc_files) == len(coarse_meshes), \
+                "Inversion 'coarse_bc_files' must give a bc file for each " \
+                "of the 'coarse_meshes'"
+        else:
+            assert len(coarse_bc_files) == 0, \
+                "Inversion 'coarse_bc_files' requires mesh 'bc_filename'"
+
+        try:  # Optional prior solver settings
+            self.prior = PriorCfg(**self.config_dict['prior'])
+        except KeyError:
+            self.prior = PriorCfg()
+
+        try:  # Optional posterior sigma settings
+            self.inv_sigma = InvSigmaCfg(**self.config_dict['invsigma'])
+        except KeyError:
+            self.inv_sigma = InvSigmaCfg()
+
+        try:  # Optional adjoint checkpointing settings
+            self.checkpointing = CheckpointCfg(**self.config_dict['checkpointing'])
+        except KeyError:
+            self.checkpointing = CheckpointCfg()
+
+        try:  # Optional ensemble settings
+            self.ensemble = EnsembleCfg(**self.config_dict['ensemble'])
+        except KeyError:
+            self.ensemble = EnsembleCfg()
+
+        try:  # Optional posterior sampling settings
+            self.sample = SampleCfg(**self.config_dict['sample'])
+        except KeyError:
+            self.sample = SampleCfg()
+
         try:  # Optional testing
             self.testing = TestCfg(**self.config_dict['testing'])
         except KeyError:
@@ -134,6 +171,59 @@ class InversionCfg(ConfigPrinter):
     gamma_beta: float = 0.0
     delta_beta: float = 0.0
 
+    # Use the row-sum (lumped) mass matrix in the regularisation term
+    # rather than a factorised consistent mass matrix
+    lumped_mass_reg: bool = False
+
+    # Optimiser: "l-bfgs-b" (scipy, via tlm_adjoint) or "newton-cg" (inexact
+    # Newton-CG, preconditioned by the prior, see optimize.py)
+    method: str = "l-bfgs-b"
+    cg_max_iter: int = 50  # Newton-CG: max CG iterations per Newton step
+    cg_eta_max: float = 0.5  # Newton-CG: max Eisenstat-Walker tolerance
+
+    # L-BFGS-B: cache (LRU) this many J & dJ evaluations, keyed on the control
+    # values, so that revisited points are free (0: tlm_adjoint's
+    # minimize_scipy, uncached)
+    eval_cache_size: int = 0
+
+    # Dual inversions: optimise [alpha, beta] together (forward_dual) rather
+    # than alternating alt_iter times ("l-bfgs-b" only)
+    joint_cntrl: bool = False
+    # L-BFGS: keep the curvature history of each control between alternations
+    # (uses optimize.minimize_l_bfgs rather than scipy)
+    keep_lbfgs_history: bool = False
+    lbfgs_history_size: int = 10
+
+    # Write io.inv_checkpoint_file after every optimiser iteration (or only
+    # after each alternation, for tlm_adjoint's minimize_scipy), from which
+    # run_inv --resume continues. Resuming is exact with keep_lbfgs_history.
+    checkpoint: bool = False
+
+    # Inexact inversion: loosen the momentum solve tolerances in proportion
+    # to the gradient norm (relative to its initial value), from at most
+    # inexact_rtol_max (Newton) & inexact_krylov_rtol_max (Krylov) down to
+    # the momsolve settings. The gradient at each optimum is then checked
+    # against one with the configured tolerances. Not with tlm_adjoint's
+    # minimize_scipy (use newton-cg, keep_lbfgs_history or eval_cache_size).
+    inexact_momsolve: bool = False
+    inexact_rtol_max: float = 1.0e-4
+    inexact_krylov_rtol_max: float = 1.0e-3
+    inexact_grad_rtol: float = 1.0e-2  # warn above this discrepancy
+
+    # Multilevel inversion: meshes (in io.input_dir, coarsest first) to invert
+    # on before mesh.mesh_filename, each level starting from the previous
+    # result. coarse_max_iter (default max_iter) applies to these levels,
+    # max_iter to the final one. If mesh.bc_filename is set, coarse_bc_files
+    # gives the boundary marker file (in io.input_dir) of each coarse mesh.
+    coarse_meshes: list = None
+    coarse_bc_files: list = None
+    coarse_max_iter: int = None
+
+    # Warm start from a previous inversion output file (relative to
+    # io.output_dir) & the mesh it was written on (default: read from file)
+    warm_start_file: str = None
+    warm_start_mesh: str = None
+
     def construct_inv_options(self):
         """
         See __post_init__
@@ -156,6 +246,25 @@ class InversionCfg(ConfigPrinter):
         """
         object.__setattr__(self,'inv_options', self.construct_inv_options())
 
+        assert self.method in ["l-bfgs-b", "newton-cg"], \
+            "Valid selections for inversion 'method' are 'l-bfgs-b' or 'newton-cg'"
+        assert not (self.joint_cntrl and self.method == "newton-cg"), \
+            "'joint_cntrl' requires inversion 'method' 'l-bfgs-b'"
+        assert not self.inexact_momsolve or self.method == "newton-cg" or \
+            (self.keep_lbfgs_history and not self.joint_cntrl) or \
+            self.eval_cache_size > 0, \
+            "'inexact_momsolve' requires method 'newton-cg', " \
+            "'keep_lbfgs_history' or 'eval_cache_size' > 0"
+
+        # The Newton-CG preconditioner is the prior (delta M + gamma K)
+        if self.method == "newton-cg":
+            for cntrl in ["alpha", "beta"]:
+                if getattr(self, f"{cntrl}_active"):
+                    assert getattr(self, f"delta_{cntrl}") != 0.0 and \
+                        getattr(self, f"gamma_{cntrl}") != 0.0, \
+                        f"'newton-cg' requires non-zero 'delta_{cntrl}' " \
+                        f"and 'gamma_{cntrl}'"
+
 @dataclass(frozen=True)
 class ObsCfg(ConfigPrinter):
     """
@@ -170,6 +279,8 @@ class ErrorPropCfg(ConfigPrinter):
     Configuration related to error propagation
     """
     qoi: str = 'vaf'
+    check_prior_norm: bool = True  # Check eigenvectors are prior-normalised
+    eig_chunk_size: int = None  # Eigenvectors read at once (default: all)
 
 @dataclass(frozen=True)
 class EigenDecCfg(ConfigPrinter):
@@ -179,6 +290,13 @@ class EigenDecCfg(ConfigPrinter):
     num_eig: int = None
     eig_algo: str = "slepc"
     power_iter: int = 1   #Number of power iterations for random algorithm
+    oversampling: int = 10  #Extra random vectors for random algorithm
+    random_seed: int = 0
+    # SLEPc: eigenpairs per solve, streamed to disk. This bounds the SLEPc
+    # workspace only: all eigenvectors found so far are held in memory, as
+    # the deflation space for the following chunks.
+    chunk_size: int = None
+    restart: bool = False   #SLEPc: continue from eigenpairs already on disk
     misfit_only: bool = False
     precondition_by: str = "prior"
     eigenvalue_thresh: float = 1e-1
@@ -190,6 +308,32 @@ class EigenDecCfg(ConfigPrinter):
         assert self.eig_algo in ["slepc", "random"], \
             "Valid selections for 'eig_algo' are 'slepc' or 'random'"
 
+@dataclass(frozen=True)
+class InvSigmaCfg(ConfigPrinter):
+    """
+    Configuration related to the control sigma (run_invsigma)
+    """
+    prior_diag: str = "exact"  # How to compute the prior variance diagonal
+    prior_diag_samples: int = 100  # Number of samples for "randomized"
+    random_seed: int = 0
+
+    def __post_init__(self):
+        assert self.prior_diag in ["exact", "randomized"], \
+            "Valid selections for 'prior_diag' are 'exact' or 'randomized'"
+
+@dataclass(frozen=True)
+class PriorCfg(ConfigPrinter):
+    """
+    Configuration of the linear solvers for the prior (laplacian) operator
+    """
+    solver: str = "cg"
+    rtol: float = 1.0e-14
+    atol: float = 1.0e-32
+
+    def __post_init__(self):
+        assert self.solver in ["cg", "amg", "cholesky"], \
+            "Valid selections for prior 'solver' are 'cg', 'amg' or 'cholesky'"
+
 @dataclass(frozen=True)
 class ConstantsCfg(ConfigPrinter):
     """
@@ -292,6 +436,10 @@ class MomsolveCfg(ConfigPrinter):
                           'convergence_criterion': 'incremental',
                           'error_on_nonconvergence': True}})
 
+    # Reuse the preconditioner (e.g. AMG hierarchy) between the Newton
+    # iterations of each Picard/Newton stage (Krylov solvers only)
+    reuse_preconditioner: bool = False
+
 
 @dataclass(frozen=True)
 class IOCfg(ConfigPrinter):
@@ -327,9 +475,21 @@ class IOCfg(ConfigPrinter):
     eigenvecs_file: str = None
     sigma_file: str = None  # "sigma.p"
     sigma_prior_file: str = None  # "sigma_prior.p"
+    ensemble_file: str = None  # "ensemble.h5"
+    samples_file: str = None  # "samples.h5"
+    inv_checkpoint_file: str = None  # "invcheckpoint.h5"
 
     log_level: str = "info"
 
+    # Time series output from ssa_solver.timestep
+    ts_output_every: int = 1  # write every n timesteps...
+    ts_output_years: float = None  # ...or every n years (overrides above)
+    ts_output_format: str = "xdmf"  # or "h5"
+    ts_output_async: bool = False  # background writer thread ("h5" only)
+    ts_compression: str = None  # "h5" only: "gzip" or "lzf"
+    ts_compression_level: int = 4
+    ts_chunk_size: int = 65536  # "h5" only: dofs per chunk
+
     def set_default_filename(self, attr_name, suffix):
         """Sets a default filename (prefixed with run_name) & check suffix"""
 
@@ -353,12 +513,21 @@ class IOCfg(ConfigPrinter):
                                           "debug"], \
             "Invalid log level"
 
+        assert self.ts_output_format in ["xdmf", "h5"], \
+            "Valid selections for 'ts_output_format' are 'xdmf' or 'h5'"
+        assert self.ts_output_format == "h5" or \
+            not (self.ts_output_async or self.ts_compression), \
+            "'ts_output_async' & 'ts_compression' require ts_output_format 'h5'"
+
         fname_default_suff = {
             'inversion_file': 'invout.h5',
             'eigenvecs_file': 'vr.h5',
             'eigenvalue_file': 'eigvals.p',
             'sigma_file': 'sigma.p',
             'sigma_prior_file': 'sigma_prior.p',
+            'ensemble_file': 'ensemble.h5',
+            'samples_file': 'samples.h5',
+            'inv_checkpoint_file': 'invcheckpoint.h5',
             'qoi_file': 'Qval_ts.p',
             'dqoi_h5file': 'dQ_ts.h5'
         }
@@ -401,6 +570,55 @@ class TimeCfg(ConfigPrinter):
             object.__setattr__(self, 'total_steps', math.ceil(self.run_length/self.dt))
             object.__setattr__(self, 'steps_per_year', 1.0/self.dt)
 
+@dataclass(frozen=True)
+class CheckpointCfg(ConfigPrinter):
+    """
+    Configuration of tlm_adjoint checkpointing for time-dependent runs
+    """
+    method: str = "multistage"
+    snaps_on_disk: int = 4000
+    snaps_in_ram: int = 10
+    ram_budget: int = None  # bytes per process; overrides snaps_in_ram
+    path: str = "checkpoints~"  # directory for checkpoints on disk
+    format: str = "pickle"
+
+    def __post_init__(self):
+        assert self.method in ["multistage", "memory"], \
+            "Valid selections for checkpointing 'method' are " \
+            "'multistage' or 'memory'"
+        assert self.format in ["pickle", "hdf5"], \
+            "Valid selections for checkpointing 'format' are 'pickle' or 'hdf5'"
+
+@dataclass(frozen=True)
+class SampleCfg(ConfigPrinter):
+    """
+    Configuration of posterior sampling (run_sample)
+    """
+    n_samples: int = 100
+    batch_size: int = 10  # Samples drawn (& written) at once
+    prior_only: bool = False  # Sample the prior rather than the posterior
+    random_seed: int = 0
+
+@dataclass(frozen=True)
+class EnsembleCfg(ConfigPrinter):
+    """
+    Configuration of ensembles of forward runs (run_ensemble)
+
+    Members either replace the control with the vectors in samples_file
+    (e.g. posterior samples) and/or scale smb & bmelt by the values in
+    smb_scale & bmelt_scale.
+    """
+    n_groups: int = 1  # Number of members run concurrently
+    n_members: int = None  # Default: set by samples_file or *_scale
+    samples_file: str = None  # Control samples (inout.MultiVectorFile)
+    samples_cntrl: str = "alpha"
+    smb_scale: list = None
+    bmelt_scale: list = None
+
+    def __post_init__(self):
+        assert self.samples_cntrl in ["alpha", "beta"], \
+            "Valid selections for 'samples_cntrl' are 'alpha' or 'beta'"
+
 @dataclass(frozen=True)
 class TestCfg(ConfigPrinter):
     """
@@ -0,0 +1,90 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Randomized solver for the generalized eigenproblem A u = lam B u
+
+Vectors are distributed: a block of k vectors is held on each process as a
+(n_local, k) numpy array of the locally owned dofs, and the operators act on
+such blocks. Only the small (k x k) dense problems are solved redundantly
+on every process.
+"""
+
+import logging
+import numpy as np
+import scipy.linalg as sl
+
+log = logging.getLogger("fenics_ice")
+
+def block_inner(comm, X, Y):
+    """Global X^T Y for distributed blocks X, Y"""
+    return comm.allreduce(X.T.dot(Y))
+
+def b_orthonormalize(comm, Y, B_action):
+    """
+    B-orthonormalize the columns of Y by (twice repeated) Cholesky QR
+
+    Returns Q, BQ with Q^T B Q = I
+    """
+    Q = Y
+    for _ in range(2):
+        BQ = B_action(Q)
+        R = sl.cholesky(block_inner(comm, Q, BQ), lower=False)
+        Q = sl.solve_triangular(R, Q.T, trans='T', lower=False).T
+    BQ = sl.solve_triangular(R, BQ.T, trans='T', lower=False).T
+    return Q, BQ
+
+def randomized_ghep(comm, A_action, B_action, Binv_action, n_local, k,
+                    n_oversample=10, power_iter=1, seed=0):
+    """
+    Double pass randomized algorithm for the generalized Hermitian
+    eigenproblem A u = lam B u (Saibaba, Lee & Kitanidis 2016, Alg. 6).
+
+    A_action, B_action, Binv_action: functions which apply A, B and B^-1 to a
+    distributed (n_local, m) block. Applying A to a whole block at once lets
+    the caller share work between the columns.
+
+    power_iter: number of applications of (B^-1 A) to the random block
+    (>= 1). Further passes sharpen the approximation when the spectrum
+    decays slowly.
+
+    Returns the k largest eigenvalues (descending) & the B-orthonormal
+    eigenvectors as a distributed (n_local, k) block.
+    """
+    assert power_iter >= 1
+    m = k + n_oversample
+
+    rng = np.random.default_rng([seed, comm.rank])
+    Y = rng.standard_normal((n_local, m))
+
+    for i in range(power_iter):
+        log.info(f"Randomized GHEP: pass {i+1} of {power_iter}")
+        Y = Binv_action(A_action(Y))
+        if i < power_iter - 1:
+            Y, _ = b_orthonormalize(comm, Y, B_action)
+
+    Q, _ = b_orthonormalize(comm, Y, B_action)
+
+    log.info("Randomized GHEP: projecting A")
+    T = block_inner(comm, Q, A_action(Q))
+    T = 0.5 * (T + T.T)
+
+    lam, V = sl.eigh(T)
+    order = np.argsort(lam)[::-1][:k]
+    lam, V = lam[order], V[:, order]
+
+    return lam, Q.dot(V)
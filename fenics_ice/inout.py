@@ -21,6 +21,8 @@ Module to handle model input & output
 
 import sys
 import time
+import queue
+import threading
 from pathlib import Path
 import pickle
 import logging
@@ -29,6 +31,8 @@ import h5py
 import netCDF4
 import git
 from scipy import interpolate as interp
+from scipy.spatial import cKDTree
+from mpi4py import MPI as MPI4PY
 
 from fenics import *
 import numpy as np
@@ -80,6 +84,417 @@ def write_dqval(dQ_ts, cntrl_names, params):
 
     hdf5out.close()
 
+class MultiVectorFile:
+    """
+    A set of vectors (e.g. eigenvectors) on one scalar function space, stored
+    in HDF5 as a single chunked (dof x vector) dataset 'vectors'.
+
+    Rows follow the global dof numbering of the writing run. The dof
+    coordinates ('dof_coords') & number of processes ('num_procs') are
+    stored too. A reader whose locally owned dofs don't match the stored
+    rows (e.g. a different number of processes) is remapped via the
+    coordinates.
+
+    Vectors are passed around as (n_local, k) numpy arrays of the locally
+    owned dofs. Each process only reads/writes its own rows: collectively
+    if h5py was built with MPI, otherwise through rank 0 (writes) or
+    independent reads.
+    """
+
+    def __init__(self, filename, space, mode='r', chunk_rows=65536):
+        assert space.ufl_element().value_size() == 1, \
+            "MultiVectorFile expects a scalar function space"
+        assert mode in ['r', 'w', 'a']
+
+        self.filename = str(filename)
+        self.space = space
+        self.comm = space.mesh().mpi_comm()
+        self.chunk_rows = chunk_rows
+
+        vec = Function(space).vector()
+        self.n_local = vec.local_size()
+        self.n_global = vec.size()
+        self.own_start, self.own_end = vec.local_range()
+        self.coords = space.tabulate_dof_coordinates()[:self.n_local]
+
+        self.parallel = h5py.get_config().mpi and self.comm.size > 1
+
+        if mode == 'w' or (mode == 'a' and not Path(self.filename).exists()):
+            self._create()
+
+        self._rows = None
+
+    def _open(self, mode):
+        if self.parallel:
+            return h5py.File(self.filename, mode, driver='mpio', comm=self.comm)
+        return h5py.File(self.filename, mode)
+
+    def _gather_rows(self, X):
+        """Gather the locally owned rows of X on rank 0"""
+        blocks = self.comm.gather((self.own_start, X), root=0)
+        if self.comm.rank == 0:
+            return blocks
+
+    def _create(self):
+        """Create the (empty) file, with dof coordinates & metadata"""
+        gdim = self.coords.shape[1]
+        chunks = (min(self.n_global, self.chunk_rows), 1)
+
+        if self.parallel:
+            with self._open('w') as f:
+                f.attrs["num_procs"] = self.comm.size
+                f.create_dataset("vectors", (self.n_global, 0),
+                                 maxshape=(self.n_global, None),
+                                 chunks=chunks, dtype=np.float64)
+                coords = f.create_dataset("dof_coords",
+                                          (self.n_global, gdim),
+                                          dtype=np.float64)
+                coords[self.own_start:self.own_end, :] = self.coords
+        else:
+            blocks = self._gather_rows(self.coords)
+            if self.comm.rank == 0:
+                with self._open('w') as f:
+                    f.attrs["num_procs"] = self.comm.size
+                    f.create_dataset("vectors", (self.n_global, 0),
+                                     maxshape=(self.n_global, None),
+                                     chunks=chunks, dtype=np.float64)
+                    coords = f.create_dataset("dof_coords",
+                                              (self.n_global, gdim),
+                                              dtype=np.float64)
+                    for start, block in blocks:
+                        coords[start:start + block.shape[0], :] = block
+            self.comm.barrier()
+
+    def append(self, X, start=None):
+        """
+        Append vectors, either a list of Functions or an (n_local, k) array
+
+        If start is given, the vectors are written from index start onwards
+        and any stored vectors beyond them are discarded.
+        """
+        if not isinstance(X, np.ndarray):
+            X = np.stack([w.vector().get_local() for w in X], axis=1)
+        assert X.shape[0] == self.n_local
+
+        k0 = self.num_vectors() if start is None else start
+        k1 = k0 + X.shape[1]
+
+        if self.parallel:
+            with self._open('a') as f:
+                dset = f["vectors"]
+                dset.resize(k1, axis=1)
+                dset[self.own_start:self.own_end, k0:k1] = X
+        else:
+            blocks = self._gather_rows(X)
+            if self.comm.rank == 0:
+                with self._open('a') as f:
+                    dset = f["vectors"]
+                    dset.resize(k1, axis=1)
+                    for start, block in blocks:
+                        dset[start:start + block.shape[0], k0:k1] = block
+            self.comm.barrier()
+
+    def num_vectors(self):
+        with self._open('r') as f:
+            return f["vectors"].shape[1]
+
+    def _local_rows(self, f):
+        """
+        Rows of the file holding this process's owned dofs: a slice if the
+        partitioning matches the writer, otherwise an index array
+        """
+        if self._rows is None:
+            coords = f["dof_coords"]
+            rows = slice(self.own_start, self.own_end)
+            same = (coords.shape[0] == self.n_global and
+                    np.allclose(coords[rows, :], self.coords))
+
+            if not self.comm.allreduce(same, op=MPI4PY.LAND):
+                log = logging.getLogger("fenics_ice")
+                log.info(f"Remapping dofs from {self.filename}")
+                tree = cKDTree(coords[:, :])
+                dist, rows = tree.query(self.coords)
+                assert np.all(dist < 1.0e-8 * max(1.0, np.abs(self.coords).max())), \
+                    f"Dofs in {self.filename} don't match the function space"
+
+            self._rows = rows
+        return self._rows
+
+    def read(self, vectors=None):
+        """
+        Read (a subset of) the vectors, returned as an (n_local, k) array
+
+        'vectors' may be a slice or a list of indices
+        """
+        if vectors is None:
+            vectors = slice(None)
+        elif not isinstance(vectors, slice):
+            vectors = np.asarray(vectors, dtype=np.int64)
+            if len(vectors) == 0:
+                return np.empty((self.n_local, 0))
+            # A contiguous run of indices is read as a slice
+            if np.all(np.diff(vectors) == 1):
+                vectors = slice(vectors[0], vectors[-1] + 1)
+
+        if isinstance(vectors, slice):
+            cols, col_order = vectors, slice(None)
+        else:
+            # h5py needs increasing, unique indices
+            cols, col_order = np.unique(vectors, return_inverse=True)
+
+        with self._open('r') as f:
+            dset = f["vectors"]
+            rows = self._local_rows(f)
+
+            if isinstance(rows, slice):
+                X = dset[rows, cols]
+            elif isinstance(cols, slice):
+                order = np.argsort(rows)
+                X = np.empty((len(rows), len(range(*cols.indices(dset.shape[1])))))
+                X[order, :] = dset[rows[order], cols]
+            elif len(rows) == 0:
+                X = np.empty((0, len(cols)))
+            else:
+                # Only one index array is allowed per h5py read, so read the
+                # span of rows & select the local ones in memory
+                r0, r1 = rows.min(), rows.max() + 1
+                X = dset[r0:r1, cols][rows - r0, :]
+
+        return X[:, col_order]
+
+    def read_functions(self, vectors=None):
+        """Read (a subset of) the vectors as a list of Functions"""
+        X = self.read(vectors)
+        W = []
+        for i in range(X.shape[1]):
+            w = Function(self.space)
+            w.vector().set_local(X[:, i])
+            w.vector().apply("insert")
+            W.append(w)
+        return W
+
+class TimeSeriesWriter:
+    """
+    Writes the time series of some Functions (e.g. H & U in
+    ssa_solver.timestep), in one of two formats:
+
+    "xdmf": one XDMF file per field, '<run_name>_<name>_ts.xdmf'
+
+    "h5": a single file '<run_name>_ts.h5' with a (time x dof) dataset per
+    field (in global dof order), chunked & optionally compressed, plus the
+    output times 't'. As for MultiVectorFile, the dof coordinates of each
+    field ('dof_coords/<name>') & the number of processes ('num_procs')
+    are stored, since the global dof order depends on the partitioning.
+    The fields are gathered on rank 0 by the caller; the file I/O (no MPI)
+    may then be done by a background thread so that the time loop doesn't
+    wait on the disk. An error in that thread is
+    re-raised, on every process, by the next call to write or close.
+    """
+
+    def __init__(self, params, fields):
+        self.fields = fields
+        self.format = params.io.ts_output_format
+        self.comm = next(iter(fields.values())).function_space().mesh().mpi_comm()
+        self.root = self.comm.rank == 0
+
+        outdir = Path(params.io.output_dir)
+        run_name = params.io.run_name
+
+        if self.format == "xdmf":
+            self.xdmf = {name: XDMFFile(self.comm,
+                                        str(outdir / f"{run_name}_{name}_ts.xdmf"))
+                         for name in fields}
+            return
+
+        self.filename = outdir / f"{run_name}_ts.h5"
+        self.compression = params.io.ts_compression
+        self.compression_opts = (params.io.ts_compression_level
+                                 if self.compression == "gzip" else None)
+        self.chunk_size = params.io.ts_chunk_size
+        self.n_out = 0
+
+        self.async_io = params.io.ts_output_async
+        self.error = None
+        self.queue = None
+
+        # Gather the dof coordinates of each field (collective)
+        dof_coords = {}
+        for name, f in fields.items():
+            vec = f.vector()
+            n_local = vec.local_size()
+            coords = f.function_space().tabulate_dof_coordinates()[:n_local]
+            blocks = self.comm.gather((vec.local_range()[0], coords), root=0)
+            if self.root:
+                values = np.empty((vec.size(), coords.shape[1]))
+                for start, block in blocks:
+                    values[start:start + block.shape[0], :] = block
+                dof_coords[name] = values
+
+        if self.root:
+            with h5py.File(self.filename, 'w') as f:
+                f.attrs["num_procs"] = self.comm.size
+                f.create_dataset("t", (0,), maxshape=(None,), dtype=np.float64)
+                for name, values in dof_coords.items():
+                    f.create_dataset(f"dof_coords/{name}", data=values)
+
+            if self.async_io:
+                self.queue = queue.Queue(maxsize=4)
+                self.thread = threading.Thread(target=self._writer,
+                                               daemon=True)
+                self.thread.start()
+
+    def write(self, t):
+        if self.format == "xdmf":
+            for name, f in self.fields.items():
+                self.xdmf[name].write(f, t)
+            return
+
+        self._check_error()
+
+        # Gather copies of the fields (collective, so in the calling thread)
+        data = {}
+        for name, f in self.fields.items():
+            vec = f.vector()
+            blocks = self.comm.gather((vec.local_range()[0], vec.get_local()),
+                                      root=0)
+            if self.root:
+                values = np.empty(vec.size())
+                for start, block in blocks:
+                    values[start:start + block.size] = block
+                data[name] = values
+
+        if self.root:
+            if self.queue is not None:
+                self.queue.put((t, data))
+            else:
+                self._write_h5(t, data)
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            # After a failure keep draining the queue, so that write()
+            # can't block on put()
+            if self.error is None:
+                try:
+                    self._write_h5(*item)
+                except Exception as e:
+                    self.error = e
+
+    def _check_error(self):
+        """Re-raise an error from the writer thread on every process"""
+        if not self.async_io:
+            return
+        failed = self.comm.bcast(self.root and self.error is not None, root=0)
+        if failed:
+            if self.root:
+                raise self.error
+            raise RuntimeError(f"Failed to write {self.filename} on rank 0")
+
+    def _write_h5(self, t, data):
+        with h5py.File(self.filename, 'a') as f:
+            n = f["t"].shape[0]
+            f["t"].resize(n + 1, axis=0)
+            f["t"][n] = t
+
+            for name, values in data.items():
+                if name not in f:
+                    f.create_dataset(name, (0, values.size),
+                                     maxshape=(None, values.size),
+                                     chunks=(1, min(values.size, self.chunk_size)),
+                                     compression=self.compression,
+                                     compression_opts=self.compression_opts,
+                                     dtype=np.float64)
+                dset = f[name]
+                dset.resize(n + 1, axis=0)
+                dset[n, :] = values
+
+    def close(self):
+        if self.format == "xdmf":
+            for xdmf in self.xdmf.values():
+                xdmf.close()
+            return
+
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self._check_error()
+        self.comm.barrier()
+
+class InversionCheckpoint:
+    """
+    Checkpoint of an inversion in progress (io.inv_checkpoint_file), written
+    after each optimiser iteration: the controls, the L-BFGS curvature pairs
+    of each control and, as attributes, the position in the inversion
+    (multilevel 'level', alternation 'alt', iterations 'n_iter') and the
+    cost function terms.
+
+    Each write goes to a temporary file which then replaces the previous
+    checkpoint, so a failure mid-write leaves the last one intact.
+    """
+
+    def __init__(self, filename, comm, level=0):
+        self.filename = Path(filename)
+        self.comm = comm
+        self.level = level
+
+    @staticmethod
+    def read_state(filename):
+        """The attributes of a checkpoint file, as a dict"""
+        with h5py.File(filename, 'r') as f:
+            return {k: (v.item() if isinstance(v, np.generic) else v)
+                    for k, v in f.attrs.items()}
+
+    def write(self, state, functions, histories=None):
+        """
+        state: dict of scalars; functions: {name: Function};
+        histories: {name: optimize.LBFGSHistory}
+        """
+        histories = histories or {}
+        tmp = self.filename.with_suffix(".tmp.h5")
+
+        with HDF5File(self.comm, str(tmp), 'w') as f:
+            for name, fn in functions.items():
+                f.write(fn, name)
+            for name, hist in histories.items():
+                for i, (s, y, _) in enumerate(hist.pairs):
+                    f.write(s, f"lbfgs/{name}/s_{i}")
+                    f.write(y, f"lbfgs/{name}/y_{i}")
+
+        self.comm.barrier()
+        if self.comm.rank == 0:
+            with h5py.File(tmp, 'a') as f:
+                f.attrs["level"] = self.level
+                for k, v in state.items():
+                    f.attrs[k] = v
+                for name, hist in histories.items():
+                    f.attrs[f"lbfgs_{name}_n"] = len(hist)
+            tmp.replace(self.filename)
+        self.comm.barrier()
+
+    def read(self, functions, histories=None):
+        """
+        Read into 'functions' & 'histories' (as for write, both updated in
+        place), returning the state dict
+        """
+        histories = histories or {}
+        state = self.read_state(self.filename)
+
+        with HDF5File(self.comm, str(self.filename), 'r') as f:
+            for name, fn in functions.items():
+                f.read(fn, name)
+            for name, hist in histories.items():
+                hist.pairs.clear()
+                for i in range(state.get(f"lbfgs_{name}_n", 0)):
+                    s = functions[name].vector().copy()
+                    y = functions[name].vector().copy()
+                    f.read(s, f"lbfgs/{name}/s_{i}", False)
+                    f.read(y, f"lbfgs/{name}/y_{i}", False)
+                    hist.append(s, y)
+
+        return state
+
 def write_variable(var, params, name=None):
     """
     Produce xml & vtk output of supplied variable (prefixed with run name)
@@ -23,17 +23,26 @@ import os
 from fenics import *
 from dolfin import *
 import numpy as np
+from scipy.spatial import cKDTree
+from mpi4py import MPI as MPI4PY
 from fenics_ice import model
 from pathlib import Path
 import logging
 
-def get_mesh(params):
+def get_mesh(params, comm=None, mesh_filename=None):
     """
     Gets mesh from file
+
+    The mesh is distributed over 'comm' (default: MPI.comm_world).
+    'mesh_filename' (in io.input_dir) overrides mesh.mesh_filename, e.g. for
+    the coarse levels of a multilevel inversion.
     """
+    if comm is None:
+        comm = MPI.comm_world
 
     dd = params.io.input_dir
-    mesh_filename = params.mesh.mesh_filename
+    if mesh_filename is None:
+        mesh_filename = params.mesh.mesh_filename
     meshfile = Path(dd) / mesh_filename
     filetype = meshfile.suffix
 
@@ -44,11 +53,11 @@ def get_mesh(params):
     assert meshfile.exists(), "Mesh file '%s' not found" % meshfile
 
     if filetype == '.xml':
-        mesh_in = Mesh(str(meshfile))
+        mesh_in = Mesh(comm, str(meshfile))
 
     elif filetype == '.xdmf':
-        mesh_in = Mesh()
-        mesh_xdmf = XDMFFile(MPI.comm_world, str(meshfile))
+        mesh_in = Mesh(comm)
+        mesh_xdmf = XDMFFile(comm, str(meshfile))
         mesh_xdmf.read(mesh_in)
 
     else:
@@ -56,6 +65,16 @@ def get_mesh(params):
 
     return mesh_in
 
+def interpolate_function(f, space, name=None):
+    """
+    Interpolate Function f onto 'space', which may be defined on a different
+    (non-matching, differently partitioned) mesh of the same domain
+    """
+    f.set_allow_extrapolation(True)
+    g = Function(space, name=f.name() if name is None else name)
+    LagrangeInterpolator.interpolate(g, f)
+    return g
+
 def get_mesh_length(mesh):
     """
     Return a scalar mesh length (i.e. square mesh - isimp only!)
@@ -106,19 +125,22 @@ def get_periodic_space(params, mesh, deg=1, dim=1):
 
     return periodic_space
 
-def get_ff_from_file(params, model, fill_val=0):
+def get_ff_from_file(params, model, fill_val=0, bc_filename=None):
     """
     Return a FacetFunction defining the boundary conditions of the mesh.
 
     Expects to find an XDMF file containing a MeshValueCollection (sparse).
     Builds a 1D MeshFunction (i.e. FacetFunction) from this, filling missing
-    values with fill_val.
+    values with fill_val. 'bc_filename' (in io.input_dir) overrides
+    mesh.bc_filename, e.g. for the coarse levels of a multilevel inversion.
     """
 
     dim = model.mesh.geometric_dimension()
 
     dd = params.io.input_dir
-    ff_filename = Path(params.mesh.bc_filename)
+    if bc_filename is None:
+        bc_filename = params.mesh.bc_filename
+    ff_filename = Path(bc_filename)
     ff_file = dd/ff_filename
 
     assert ff_file.suffix == ".xdmf"
@@ -126,7 +148,7 @@ def get_ff_from_file(params, model, fill_val=0):
 
     # Read the MeshValueCollection (sparse)
     ff_mvc = MeshValueCollection("size_t", model.mesh, dim=dim-1)
-    ff_xdmf = XDMFFile(MPI.comm_world, str(ff_file))
+    ff_xdmf = XDMFFile(model.mesh.mpi_comm(), str(ff_file))
     ff_xdmf.read(ff_mvc)
 
     # Create FacetFunction filled w/ default
@@ -145,3 +167,79 @@ def get_ff_from_file(params, model, fill_val=0):
         ff_arr[entity_index] = value
 
     return ff
+
+def locate_points(mesh, pts, n_candidates=8, tol=1e-10):
+    """
+    Find the locally owned (triangular) cells containing a set of points
+
+    Vectorised replacement for looping over compute_first_entity_collision.
+    Each point is tested against the n_candidates cells with the nearest
+    midpoints; the few points which could lie in a local cell but aren't
+    found this way fall back to the bounding box tree.
+
+    A point on a partition boundary lies in owned cells on several
+    processes; it is assigned to the lowest of these ranks, so that each
+    point is owned exactly once. Collective on mesh.mpi_comm(), and pts
+    must be the same on every process.
+
+    Returns:
+    cells : index of the owning cell for each point (-1 if not owned here)
+    bary : barycentric coordinates of each point within that cell
+    """
+    cells, bary = _locate_points_local(mesh, pts, n_candidates, tol)
+
+    comm = mesh.mpi_comm()
+    if comm.size > 1:
+        owner = np.where(cells >= 0, comm.rank, comm.size).astype(np.int64)
+        comm.Allreduce(MPI4PY.IN_PLACE, owner, op=MPI4PY.MIN)
+        lost = owner != comm.rank
+        cells[lost] = -1
+        bary[lost] = 0.0
+
+    return cells, bary
+
+def _locate_points_local(mesh, pts, n_candidates, tol):
+    """locate_points on this process alone (points may also be found elsewhere)"""
+    n_owned = mesh.topology().ghost_offset(mesh.topology().dim())
+    verts = mesh.coordinates()[mesh.cells()[:n_owned]]  # [cell, vertex, xy]
+
+    npts = pts.shape[0]
+    cells = np.full(npts, -1, dtype=np.int64)
+    bary = np.zeros((npts, 3))
+    if n_owned == 0 or npts == 0:
+        return cells, bary
+
+    def barycentric(cell_verts, x):
+        """Barycentric coords of x (..., 2) in triangles (..., 3, 2)"""
+        v0 = cell_verts[..., 0, :]
+        T = np.stack((cell_verts[..., 1, :] - v0,
+                      cell_verts[..., 2, :] - v0), axis=-1)
+        lam = np.linalg.solve(T, (x - v0)[..., None])[..., 0]
+        return np.concatenate((1.0 - lam.sum(axis=-1, keepdims=True), lam), axis=-1)
+
+    midpoints = verts.mean(axis=1)
+    radius = np.max(np.linalg.norm(verts - midpoints[:, None, :], axis=-1))
+
+    k = min(n_candidates, n_owned)
+    dist, cand = cKDTree(midpoints).query(pts, k=k)
+    dist, cand = dist.reshape(npts, k), cand.reshape(npts, k)
+
+    cand_bary = barycentric(verts[cand], pts[:, None, :])
+    inside = np.all(cand_bary >= -tol, axis=-1)
+    found = np.any(inside, axis=1)
+    first = np.argmax(inside, axis=1)
+
+    idx = np.flatnonzero(found)
+    cells[idx] = cand[idx, first[idx]]
+    bary[idx] = cand_bary[idx, first[idx]]
+
+    # A point further than 'radius' from every local midpoint can't be in a
+    # local cell; only search the remainder the slow way.
+    bbox = mesh.bounding_box_tree()
+    for i in np.flatnonzero(~found & (dist[:, 0] <= radius)):
+        c = bbox.compute_first_entity_collision(Point(*pts[i]))
+        if c < n_owned:
+            cells[i] = c
+            bary[i] = barycentric(verts[c], pts[i])
+
+    return cells, bary
@@ -31,10 +31,12 @@ log = logging.getLogger("fenics_ice")
 class model:
 
     def __init__(self, mesh_in, input_data, param_in, init_fields=True,
-                 init_vel_obs=True):
+                 init_vel_obs=True, bc_filename=None):
 
         # Initiate parameters
         self.params = param_in
+        # Boundary markers of mesh_in (default: mesh.bc_filename)
+        self.bc_filename = bc_filename
         self.input_data = input_data
         self.solvers = []
         self.parallel = MPI.size(mesh_in.mpi_comm()) > 1
@@ -150,6 +152,51 @@ class model:
             infile.read(self.beta, 'beta')
             self.beta_bgd = self.beta.copy(deepcopy=True)
 
+    def cntrl_from_file(self, filename, mesh_filename=None):
+        """
+        Read alpha & beta from an inversion output file (e.g. the invout.h5
+        of a previous run), returning them on the mesh they were written on.
+
+        This mesh is read from 'mesh_filename' (in io.input_dir) if given,
+        otherwise from the file itself (written by run_inv). See
+        cntrl_from_functions to interpolate the results onto this model.
+        """
+        comm = self.mesh.mpi_comm()
+
+        if mesh_filename is not None:
+            src_mesh = fice_mesh.get_mesh(self.params, comm=comm,
+                                          mesh_filename=mesh_filename)
+
+        with HDF5File(comm, str(filename), 'r') as infile:
+            if mesh_filename is None:
+                assert infile.has_dataset('mesh'), \
+                    "No mesh in %s, specify the mesh it was written on" % filename
+                src_mesh = Mesh(comm)
+                infile.read(src_mesh, 'mesh', False)
+
+            if not self.params.mesh.periodic_bc:
+                src_space = FunctionSpace(src_mesh, 'Lagrange', 1)
+            else:
+                src_space = fice_mesh.get_periodic_space(self.params,
+                                                         src_mesh, dim=1)
+
+            alpha = Function(src_space, name='alpha')
+            beta = Function(src_space, name='beta')
+            infile.read(alpha, 'alpha')
+            infile.read(beta, 'beta')
+
+        return alpha, beta
+
+    def cntrl_from_functions(self, alpha=None, beta=None):
+        """
+        Set alpha and/or beta by interpolating Functions defined on another
+        mesh of the domain (e.g. a coarser level of a multilevel inversion)
+        """
+        if alpha is not None:
+            self.alpha = fice_mesh.interpolate_function(alpha, self.Qp, 'alpha')
+        if beta is not None:
+            self.beta = fice_mesh.interpolate_function(beta, self.Qp, 'beta')
+
     def init_beta(self, beta, pert=False):
         """
         Define the beta field from input
@@ -369,7 +416,8 @@ class model:
 
         else:
             # Read the facet function from a file containing a sparse MeshValueCollection
-            self.ff = fice_mesh.get_ff_from_file(self.params, model=self, fill_val=0)
+            self.ff = fice_mesh.get_ff_from_file(self.params, model=self, fill_val=0,
+                                                 bc_filename=self.bc_filename)
 
 class PeriodicBoundary(SubDomain):
     def __init__(self, L):
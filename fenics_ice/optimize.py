@@ -0,0 +1,436 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Optimisers for the inversion, alongside tlm_adjoint's minimize_scipy
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+import numpy as np
+import scipy.optimize
+
+from fenics import *
+from tlm_adjoint_fenics import *
+from tlm_adjoint_fenics.hessian_optimization import *
+
+log = logging.getLogger("fenics_ice")
+
+def record_functional(forward, m):
+    """Run forward(m) with the manager recording, returning the functional"""
+    reset_manager()
+    clear_caches()
+    start_manager()
+    J = forward(m)
+    stop_manager()
+    return J
+
+class EvalCache:
+    """
+    LRU cache of the functional value & gradient returned by forward(M),
+    keyed on a hash of the control values (M: a Function or list of them)
+    and, if given, the (hashable) return value of extra_key(), e.g. solver
+    tolerances which change how forward(M) is computed.
+
+    Each miss runs (& records) the forward model then the adjoint; repeated
+    requests at a point still in the cache are free.
+    """
+
+    def __init__(self, forward, M, size=4, extra_key=None):
+        self.forward = forward
+        self.M = M
+        self.M_list = list(M) if isinstance(M, (list, tuple)) else [M]
+        self.comm = self.M_list[0].function_space().mesh().mpi_comm()
+        self.size = size
+        self.extra_key = extra_key
+        self.cache = OrderedDict()
+        self.n_requests = 0
+        self.n_hits = 0
+
+    def key(self):
+        """Hash of the (global) control values, identical on all ranks"""
+        h = hashlib.sha1()
+        for m in self.M_list:
+            h.update(m.vector().get_local().tobytes())
+        key = tuple(self.comm.allgather(h.hexdigest()))
+        if self.extra_key is not None:
+            key += (self.extra_key(),)
+        return key
+
+    def evaluate(self):
+        """(J, [dJ]) at the current control values, dJ as local arrays"""
+        self.n_requests += 1
+        key = self.key()
+        if key in self.cache:
+            self.n_hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        J = record_functional(self.forward, self.M)
+        dJ = compute_gradient(J, self.M)
+        if not isinstance(dJ, (list, tuple)):
+            dJ = [dJ]
+
+        value = (J.value(), [d.vector().get_local() for d in dJ])
+        self.cache[key] = value
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return value
+
+    def log_stats(self):
+        n_eval = self.n_requests - self.n_hits
+        log.info("Evaluation cache: %d requests, %d forward/adjoint "
+                 "evaluations, %d hits (%.1f%%)" %
+                 (self.n_requests, n_eval, self.n_hits,
+                  100.0 * self.n_hits / max(self.n_requests, 1)))
+
+def minimize_scipy_cached(forward, M, cache_size=4, method="L-BFGS-B",
+                          options=None, callback=None, grad_callback=None,
+                          cache_key=None):
+    """
+    As tlm_adjoint's minimize_scipy, but with the functional & its gradient
+    computed together through an EvalCache. The controls M (a Function or
+    list of them) are updated in place. callback(n_iter) is called after
+    each iteration, with M set to the current iterate, & grad_callback(
+    max|dJ|) at the initial point & after each iteration (not for line
+    search trials). If grad_callback changes how J is computed, cache_key
+    (see EvalCache extra_key) should reflect this. Returns (M, scipy result).
+    """
+    cache = EvalCache(forward, M, size=cache_size, extra_key=cache_key)
+    M_list, comm = cache.M_list, cache.comm
+
+    # The global control vector: each Function's values, in rank order
+    local_sizes = np.array(comm.allgather(
+        [m.vector().local_size() for m in M_list]))
+    offsets = np.cumsum(np.concatenate([[0], local_sizes.T.ravel()]))
+
+    def gather(arrays):
+        return np.concatenate([np.concatenate(comm.allgather(a))
+                               for a in arrays])
+
+    def scatter(x):
+        for i, m in enumerate(M_list):
+            j = i * comm.size + comm.rank
+            m.vector().set_local(x[offsets[j]:offsets[j + 1]])
+            m.vector().apply("insert")
+
+    def fun(x):
+        scatter(x)
+        J_val, dJ = cache.evaluate()
+        return J_val, gather(dJ)
+
+    def accepted(x):
+        """grad_callback at an accepted point (normally a cache hit)"""
+        scatter(x)
+        _, dJ = cache.evaluate()
+        grad_callback(np.abs(gather(dJ)).max())
+
+    n_iter = 0
+    def scipy_callback(xk):
+        nonlocal n_iter
+        n_iter += 1
+        if grad_callback is not None:
+            accepted(xk)
+        if callback is not None:
+            scatter(xk)
+            callback(n_iter)
+
+    x0 = gather([m.vector().get_local() for m in M_list])
+    if grad_callback is not None:
+        accepted(x0)
+
+    result = scipy.optimize.minimize(
+        fun, x0, jac=True, method=method, options=options,
+        callback=None if callback is None and grad_callback is None
+        else scipy_callback)
+    scatter(result.x)
+
+    cache.log_stats()
+    return M, result
+
+def line_search(forward, m, p, J_val, slope, stats, step=1.0,
+                c_armijo=1.0e-4, max_backtrack=10):
+    """
+    Armijo backtracking along direction p from m, recording each trial (so
+    the accepted one provides the tape for the next gradient). Updates m in
+    place & returns (J, J_val, step), or None (m unchanged) on failure.
+    """
+    m_0 = function_copy(m)
+    for _ in range(max_backtrack):
+        m.assign(m_0)
+        m.vector().axpy(step, p)
+        J_new = record_functional(forward, m)
+        stats["n_fwd"] += 1
+        J_new_val = J_new.value()
+        if J_new_val <= J_val + c_armijo * step * slope:
+            return J_new, J_new_val, step
+        step *= 0.5
+
+    m.assign(m_0)
+    record_functional(forward, m)
+    stats["n_fwd"] += 1
+    return None
+
+class LBFGSHistory:
+    """
+    The L-BFGS curvature pairs (s, y), which may be carried between calls to
+    minimize_l_bfgs (e.g. across alternations of a dual inversion)
+    """
+
+    def __init__(self, m_max=10):
+        self.m_max = m_max
+        self.pairs = []  # (s, y, 1 / s.y), oldest first
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def append(self, s, y):
+        """Add a pair, unless it violates the curvature condition"""
+        sy = s.inner(y)
+        if sy <= 1.0e-12 * np.sqrt(s.inner(s) * y.inner(y)):
+            log.info("L-BFGS: skipping update, s.y = %.3e" % sy)
+            return
+        self.pairs.append((s, y, 1.0 / sy))
+        if len(self.pairs) > self.m_max:
+            self.pairs.pop(0)
+
+    def inv_hessian_action(self, g):
+        """The inverse Hessian approximation applied to g (two-loop)"""
+        q = g.copy()
+        a = []
+        for s, y, rho in reversed(self.pairs):
+            a.append(rho * s.inner(q))
+            q.axpy(-a[-1], y)
+
+        if len(self.pairs) > 0:
+            s, y, _ = self.pairs[-1]
+            q *= s.inner(y) / y.inner(y)
+
+        for (s, y, rho), a_i in zip(self.pairs, reversed(a)):
+            q.axpy(a_i - rho * y.inner(q), s)
+        return q
+
+def minimize_l_bfgs(forward, m, history=None, maxiter=15, gtol=None,
+                    ftol=None, c_armijo=1.0e-4, max_backtrack=20,
+                    callback=None, grad_callback=None):
+    """
+    L-BFGS minimisation of the functional returned by forward(m), updating
+    the control Function m in place.
+
+    Unlike minimize_scipy, the curvature pairs are held in 'history' (an
+    LBFGSHistory, updated in place), so that a later call for the same
+    control can continue from them. Steps are found by Armijo backtracking
+    (see line_search). Convergence criteria are as for minimize_newton_cg.
+    callback(n_iter) is called after each iteration & grad_callback(max|g|)
+    after each gradient evaluation, i.e. at the initial & each accepted
+    point (never during a line search). Returns (m, stats).
+    """
+    if history is None:
+        history = LBFGSHistory()
+
+    stats = {"n_iter": 0, "n_fwd": 0, "n_grad": 0, "converged": False}
+
+    J = record_functional(forward, m)
+    stats["n_fwd"] += 1
+    J_val = J.value()
+    g = compute_gradient(J, m).vector().copy()
+    stats["n_grad"] += 1
+    if grad_callback is not None:
+        grad_callback(g.norm("linf"))
+
+    for it in range(maxiter):
+        g_max = g.norm("linf")
+        if gtol is not None and g_max <= gtol:
+            stats["converged"] = True
+            break
+
+        p = history.inv_hessian_action(g)
+        p *= -1.0
+        slope = p.inner(g)
+        if slope >= 0.0:
+            log.warning("L-BFGS: not a descent direction, resetting history")
+            history.pairs.clear()
+            p = g.copy()
+            p *= -1.0
+            slope = p.inner(g)
+
+        # As L-BFGS-B, the first step has unit length
+        step = 1.0 if len(history) > 0 else min(1.0, 1.0 / p.norm("l2"))
+
+        result = line_search(forward, m, p, J_val, slope, stats, step=step,
+                             c_armijo=c_armijo, max_backtrack=max_backtrack)
+        if result is None:
+            log.warning("L-BFGS: line search failed")
+            break
+        J_new, J_new_val, step = result
+
+        g_new = compute_gradient(J_new, m).vector().copy()
+        stats["n_grad"] += 1
+        if grad_callback is not None:
+            grad_callback(g_new.norm("linf"))
+
+        s_vec = p
+        s_vec *= step
+        y_vec = g_new.copy()
+        y_vec.axpy(-1.0, g)
+        history.append(s_vec, y_vec)
+
+        stats["n_iter"] += 1
+        log.info(f"L-BFGS iteration {it+1}: J = {J_new_val:.8e}, "
+                 f"max|g| = {g_max:.3e}, step = {step:.3e}, "
+                 f"history = {len(history)}")
+        if callback is not None:
+            callback(stats["n_iter"])
+
+        J_change = (J_val - J_new_val) / max(abs(J_val), abs(J_new_val), 1.0)
+        J_val, g = J_new_val, g_new
+        if ftol is not None and J_change <= ftol:
+            stats["converged"] = True
+            break
+
+    log.info("L-BFGS: {n_iter} iterations, {n_fwd} forward, {n_grad} "
+             "gradient evaluations (converged: {converged})".format(**stats))
+    return m, stats
+
+def minimize_newton_cg(forward, m, precond, maxiter=15, gtol=None, ftol=None,
+                       cg_maxiter=50, eta_max=0.5, c_armijo=1.0e-4,
+                       max_backtrack=10, callback=None, grad_callback=None):
+    """
+    Inexact (truncated) Newton-CG minimisation of the functional returned by
+    forward(m), updating the control Function m in place.
+
+    At each iteration the Newton system H p = -g is solved approximately by
+    preconditioned CG, with Hessian actions from SingleBlockHessian on the
+    current tape and precond(r, z) (e.g. the prior covariance,
+    prior.laplacian.inv_action) mapping a residual r to z. CG is truncated at
+    a relative tolerance eta chosen by the Eisenstat-Walker rule (choice 2),
+    or on negative curvature. The step is globalised by Armijo backtracking,
+    each trial being recorded so that the accepted one provides the tape for
+    the next gradient & Hessian (see line_search).
+
+    Convergence (as for L-BFGS-B): max |g| <= gtol or a relative reduction in
+    J of at most ftol. callback(n_iter) is called after each iteration &
+    grad_callback(max|g|) after each gradient evaluation, i.e. at the initial
+    & each accepted point (never during a line search). Returns (m, stats).
+    """
+    space = m.function_space()
+    p, d = Function(space), Function(space)
+    r, z = Function(space).vector(), Function(space).vector()
+
+    stats = {"n_iter": 0, "n_fwd": 0, "n_grad": 0, "n_hess": 0,
+             "n_cg": 0, "converged": False}
+
+    J = record_functional(forward, m)
+    stats["n_fwd"] += 1
+    J_val = J.value()
+
+    eta, g_norm_prev = eta_max, None
+    for it in range(maxiter):
+
+        dJ = compute_gradient(J, m)
+        stats["n_grad"] += 1
+        g = dJ.vector()
+
+        g_max = g.norm("linf")
+        if grad_callback is not None:
+            grad_callback(g_max)
+        if gtol is not None and g_max <= gtol:
+            stats["converged"] = True
+            break
+
+        # Preconditioned residual of H p = -g, starting from p = 0
+        r.zero()
+        r.axpy(-1.0, g)
+        precond(r, z)
+        rz = r.inner(z)
+        g_norm = np.sqrt(rz)
+
+        # Eisenstat-Walker forcing term (choice 2, gamma = 0.9, alpha = 2)
+        if g_norm_prev is not None:
+            eta_new = 0.9 * (g_norm / g_norm_prev) ** 2
+            safeguard = 0.9 * eta ** 2
+            if safeguard > 0.1:
+                eta_new = max(eta_new, safeguard)
+            eta = min(eta_new, eta_max)
+        g_norm_prev = g_norm
+
+        # Truncated PCG
+        ddJ = SingleBlockHessian(J)
+        p.vector().zero()
+        d.vector().zero()
+        d.vector().axpy(1.0, z)
+        for i in range(cg_maxiter):
+            _, _, Hd = ddJ.action(m, d)
+            stats["n_hess"] += 1
+            stats["n_cg"] += 1
+            Hd_vec = Hd.vector()
+
+            dHd = d.vector().inner(Hd_vec)
+            if dHd <= 0.0:
+                log.info(f"Newton-CG: negative curvature at CG iteration {i}")
+                if i == 0:
+                    p.vector().axpy(1.0, d.vector())
+                break
+
+            a = rz / dHd
+            p.vector().axpy(a, d.vector())
+            r.axpy(-a, Hd_vec)
+            precond(r, z)
+            rz_new = r.inner(z)
+            if np.sqrt(rz_new) <= eta * g_norm:
+                break
+
+            d_vec = d.vector()
+            d_vec *= rz_new / rz
+            d_vec.axpy(1.0, z)
+            rz = rz_new
+
+        # Armijo backtracking line search
+        slope = p.vector().inner(g)
+        if slope >= 0.0:
+            log.warning("Newton-CG: not a descent direction, "
+                        "using the preconditioned gradient")
+            r.zero()
+            r.axpy(-1.0, g)
+            precond(r, p.vector())
+            slope = p.vector().inner(g)
+
+        result = line_search(forward, m, p.vector(), J_val, slope, stats,
+                             c_armijo=c_armijo, max_backtrack=max_backtrack)
+        if result is None:
+            log.warning("Newton-CG: line search failed")
+            break
+        J_new, J_new_val, step = result
+
+        stats["n_iter"] += 1
+        log.info(f"Newton-CG iteration {it+1}: J = {J_new_val:.8e}, "
+                 f"max|g| = {g_max:.3e}, CG iterations = {i+1}, "
+                 f"eta = {eta:.3e}, step = {step:.3e}")
+        if callback is not None:
+            callback(stats["n_iter"])
+
+        J_change = (J_val - J_new_val) / max(abs(J_val), abs(J_new_val), 1.0)
+        J, J_val = J_new, J_new_val
+        if ftol is not None and J_change <= ftol:
+            stats["converged"] = True
+            break
+
+    log.info("Newton-CG: {n_iter} iterations, {n_fwd} forward, {n_grad} "
+             "gradient, {n_hess} Hessian actions (converged: "
+             "{converged})".format(**stats))
+    return m, stats
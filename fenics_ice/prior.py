@@ -15,13 +15,137 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
+import time
+import logging
+import numpy as np
 from dolfin import *
 from tlm_adjoint import *
+import petsc4py.PETSc as PETSc
 from .decorators import count_calls, timer
 
+log = logging.getLogger("fenics_ice")
+
+class PriorSolver:
+    """
+    Linear solver for one of the prior operators (A or M), which records the
+    number of solves, Krylov iterations and time spent.
+
+    method:
+      "cg"       : CG, preconditioned by SOR
+      "amg"      : CG, preconditioned by hypre BoomerAMG (jacobi for the mass)
+      "cholesky" : Sparse Cholesky factorisation, computed on the first solve
+                   and reused thereafter (MUMPS if available, and
+                   required in parallel)
+    """
+
+    def __init__(self, mat, method, name, mass=False,
+                 rtol=1.0e-14, atol=1.0e-32):
+
+        self.name = name
+        self.method = method
+        self.mat = mat
+        self.n_solves = 0
+        self.n_iter = 0
+        self.time = 0.0
+
+        if method == "cholesky":
+            self.ksp = PETSc.KSP().create(mat.mpi_comm())
+            self.ksp.setOperators(as_backend_type(mat).mat())
+            self.ksp.setType("preonly")
+            pc = self.ksp.getPC()
+            pc.setType("cholesky")
+            if PETSc.Sys.hasExternalPackage("mumps"):
+                pc.setFactorSolverType("mumps")
+            else:
+                # PETSc's native Cholesky factorisation is serial only
+                assert MPI.size(mat.mpi_comm()) == 1, \
+                    "Prior solver 'cholesky' requires MUMPS in parallel"
+            self.ksp.setFromOptions()
+            self.solver = None
+        else:
+            if method == "amg" and not mass:
+                assert has_krylov_solver_preconditioner("hypre_amg"), \
+                    "hypre_amg is not available for prior solver 'amg'"
+                pc_type = "hypre_amg"
+            elif mass:
+                # The mass matrix is well conditioned on any mesh
+                pc_type = "jacobi" if method == "amg" else "sor"
+            else:
+                pc_type = "sor"
+
+            self.solver = KrylovSolver("cg", pc_type)
+            self.solver.parameters.update({"absolute_tolerance": atol,
+                                           "relative_tolerance": rtol})
+            self.solver.set_operator(mat)
+
+    def solve(self, x, b):
+        t0 = time.perf_counter()
+
+        if self.solver is None:
+            self.ksp.solve(as_backend_type(b).vec(), as_backend_type(x).vec())
+            as_backend_type(x).update_ghost_values()
+            iters = self.ksp.getIterationNumber()
+        else:
+            iters = self.solver.solve(x, b)
+
+        self.time += time.perf_counter() - t0
+        self.n_solves += 1
+        self.n_iter += iters
+        return iters
+
+    def solve_block(self, X):
+        """
+        Solve for an (n_local, k) block of right hand sides, returning the
+        (n_local, k) block of solutions.
+
+        The cholesky backend applies its factorisation to all k at once
+        (KSPMatSolve), otherwise the columns are solved in turn.
+        """
+        n_local, k = X.shape
+
+        if self.solver is None and hasattr(self.ksp, "matSolve"):
+            t0 = time.perf_counter()
+
+            mat = as_backend_type(self.mat).mat()
+            comm = mat.getComm()
+            sizes = (mat.getSizes()[0], (PETSc.DECIDE, k))
+            B = PETSc.Mat().createDense(sizes, array=np.asfortranarray(X),
+                                        comm=comm)
+            Y = PETSc.Mat().createDense(sizes, comm=comm)
+            B.assemble()
+            Y.assemble()
+            self.ksp.matSolve(B, Y)
+            Y_arr = Y.getDenseArray().copy()
+
+            self.time += time.perf_counter() - t0
+            self.n_solves += k
+            return Y_arr
+
+        x, b = Vector(), Vector()
+        self.mat.init_vector(x, 0)
+        self.mat.init_vector(b, 0)
+        Y_arr = np.empty_like(X)
+        for i in range(k):
+            b.set_local(X[:, i])
+            b.apply("insert")
+            self.solve(x, b)
+            Y_arr[:, i] = x.get_local()
+        return Y_arr
+
+    def log_stats(self):
+        if self.n_solves == 0:
+            return
+        log.info("Prior %s solver (%s): %d solves, %d iterations "
+                 "(%.1f per solve), %.3f s (%.3e s per solve)" %
+                 (self.name, self.method, self.n_solves, self.n_iter,
+                  self.n_iter / self.n_solves, self.time,
+                  self.time / self.n_solves))
+
+
 class laplacian(object):
 
-    def __init__(self, delta, gamma, space):
+    def __init__(self, delta, gamma, space, solver="cg",
+                 rtol=1.0e-14, atol=1.0e-32):
 
         self.space = space
 
@@ -31,16 +155,12 @@ class laplacian(object):
         var_n = inner(grad(test), grad(trial)) * dx
 
         self.M = assemble(var_m)
-        self.M_solver = KrylovSolver("cg", "sor")
-        self.M_solver.parameters.update({"absolute_tolerance": 1.0e-32,
-                                         "relative_tolerance": 1.0e-14})
-        self.M_solver.set_operator(self.M)
+        self.M_solver = PriorSolver(self.M, solver, "M", mass=True,
+                                    rtol=rtol, atol=atol)
 
         self.A = assemble(delta * var_m + gamma * var_n)
-        self.A_solver = KrylovSolver("cg", "sor")
-        self.A_solver.parameters.update({"absolute_tolerance": 1.0e-32,
-                                         "relative_tolerance": 1.0e-14})
-        self.A_solver.set_operator(self.A)
+        self.A_solver = PriorSolver(self.A, solver, "A",
+                                    rtol=rtol, atol=atol)
 
         self.tmp1, self.tmp2 = Function(space), Function(space)
 
@@ -101,6 +221,36 @@ class laplacian(object):
         y.set_local(self.tmp1.get_local())
         y.apply("insert")
 
+    def _mult_block(self, mat, X):
+        """mat applied to each column of an (n_local, k) block X"""
+        Y = np.empty_like(X)
+        for i in range(X.shape[1]):
+            self.tmp1.set_local(X[:, i])
+            self.tmp1.apply("insert")
+            mat.mult(self.tmp1, self.tmp2)
+            Y[:, i] = self.tmp2.get_local()
+        return Y
+
+    def action_block(self, X):
+        """
+        L M^-1 L applied to each column of an (n_local, k) block X
+        """
+        Y = self.M_solver.solve_block(self._mult_block(self.A, X))
+        return self._mult_block(self.A, Y)
+
+    def inv_action_block(self, X):
+        """
+        L^-1 M L^-1 applied to each column of an (n_local, k) block X
+        """
+        Y = self.A_solver.solve_block(X)
+        return self.A_solver.solve_block(self._mult_block(self.M, Y))
+
+    def approx_root_inv_action_block(self, X):
+        """
+        L^-1 M_lump^1/2 applied to each column of an (n_local, k) block X
+        """
+        return self.A_solver.solve_block(self.M_rl.get_local()[:, None] * X)
+
     def approx_action(self, x, y):
         """
         L M_lump^-1L
@@ -131,6 +281,76 @@ class laplacian(object):
         self.tmp1 = self.M_rl * x_tmp
         self.A_solver.solve(y_tmp, self.tmp1)
 
+    def inv_action_diagonal(self, method="exact", n_samples=100, seed=0,
+                            block_size=64):
+        """
+        Diagonal of L^-1 M L^-1 (i.e. the prior covariance), returned as the
+        locally owned values.
+
+        "exact" applies inv_action to each unit vector in turn (N solves, but
+        no other communication). With the cholesky backend the unit vectors
+        are instead passed to inv_action_block in batches of block_size, so
+        that each batch shares a single pair of block solves. "randomized" is
+        the stochastic estimator of Bekas et al. (2007):
+        diag ~ mean(z * L^-1 M L^-1 z) over n_samples Rademacher vectors z.
+        """
+        x = Function(self.space).vector()
+        y = Function(self.space).vector()
+        n_local = x.local_size()
+        diag = np.zeros(n_local)
+
+        if method == "exact" and self.A_solver.method == "cholesky":
+            own_start, own_end = x.local_range()
+            N = x.size()
+            for j0 in range(0, N, block_size):
+                j1 = min(j0 + block_size, N)
+                # Owned rows of the unit vectors e_j0 ... e_j1-1
+                rows = np.arange(max(j0, own_start), min(j1, own_end))
+                E = np.zeros((n_local, j1 - j0))
+                E[rows - own_start, rows - j0] = 1.0
+
+                Y = self.inv_action_block(E)
+                diag[rows - own_start] = Y[rows - own_start, rows - j0]
+
+        elif method == "exact":
+            own_start, own_end = x.local_range()
+            e_j = np.zeros(n_local)
+            for j in range(x.size()):
+                owned = own_start <= j < own_end
+                if owned:
+                    e_j[j - own_start] = 1.0
+                x.set_local(e_j)
+                x.apply("insert")
+
+                self.inv_action(x, y)
+
+                if owned:
+                    e_j[j - own_start] = 0.0
+                    diag[j - own_start] = y.vec().getValue(j)
+
+        elif method == "randomized":
+            comm = self.space.mesh().mpi_comm()
+            rng = np.random.default_rng([seed, comm.rank])
+            for k in range(n_samples):
+                z = rng.choice([-1.0, 1.0], size=n_local)
+                x.set_local(z)
+                x.apply("insert")
+
+                self.inv_action(x, y)
+
+                diag += z * y.get_local()
+            diag /= n_samples
+
+        else:
+            raise NotImplementedError(f"Unrecognised method: {method}")
+
+        return diag
+
+    def log_stats(self):
+        """Report iteration counts & timings of the A and M solves"""
+        self.A_solver.log_stats()
+        self.M_solver.log_stats()
+
 
 class LumpedPC:
     """
@@ -0,0 +1,70 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Sampling from the Laplace approximation to the posterior
+"""
+
+import numpy as np
+
+class PosteriorSampler:
+    """
+    Draws (zero mean) samples from the low rank approximation to the
+    posterior covariance (Isaac 20):
+
+      G_post = G_prior - W D W^T,   D = diag(lam / (lam + 1))
+
+    where G_prior = L^-1 M L^-1 = B^-1 (see prior.laplacian) and W are the
+    B-orthonormal eigenvectors of the GHEP. A prior sample is
+
+      x = L^-1 M_lump^1/2 z,  z ~ N(0, I)
+
+    (exact for the lumped mass matrix), and
+
+      y = x - W P W^T B x,   P = diag(1 - 1 / sqrt(1 + lam))
+
+    has covariance G_prior - W (2P - P^2) W^T = G_post.
+
+    Samples are drawn in batches, as distributed (n_local, k) blocks, so
+    that the prior operator's block solves (e.g. a cached Cholesky
+    factorisation) are applied to a whole batch at once.
+    """
+
+    def __init__(self, reg_op, lam, W, comm, seed=0):
+        """
+        reg_op: prior.laplacian
+        lam, W: eigenvalues & (n_local, n_eig) block of eigenvectors
+        """
+        self.reg_op = reg_op
+        self.W = W
+        self.P = 1.0 - 1.0 / np.sqrt(1.0 + lam)
+        self.comm = comm
+        self.rng = np.random.default_rng([seed, comm.rank])
+
+    def prior_samples(self, k):
+        """k samples from the prior, as an (n_local, k) block"""
+        Z = self.rng.standard_normal((self.W.shape[0], k))
+        return self.reg_op.approx_root_inv_action_block(Z)
+
+    def posterior_samples(self, k):
+        """k samples from the posterior, as an (n_local, k) block"""
+        X = self.prior_samples(k)
+        if self.W.shape[1] == 0:
+            return X
+
+        WtBX = self.comm.allreduce(self.W.T.dot(self.reg_op.action_block(X)))
+        return X - self.W.dot(self.P[:, None] * WtBX)
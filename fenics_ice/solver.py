@@ -16,7 +16,6 @@
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
 import time
-from pathlib import Path
 import numpy as np
 
 from fenics import *
@@ -26,6 +25,15 @@ from tlm_adjoint_fenics.hessian_optimization import *
 # from dolfin_adjoint_custom import EquationSolver
 import ufl
 import logging
+import scipy.sparse as sp
+import petsc4py.PETSc as PETSc
+from mpi4py import MPI as MPI4PY
+
+from fenics_ice import mesh as fice_mesh
+from fenics_ice import inout
+from fenics_ice import prior
+from fenics_ice.optimize import minimize_newton_cg, minimize_l_bfgs, \
+    minimize_scipy_cached, LBFGSHistory, record_functional
 
 log = logging.getLogger("fenics_ice")
 
@@ -89,6 +97,16 @@ class ssa_solver:
         self.M = model.M
         self.RT = model.RT
 
+        # Persistent nonlinear solvers for the momentum equation, which keep
+        # their Jacobian sparsity & linear solvers between forward solves
+        momsolve = self.params.momsolve
+        self.picard_solver = MomentumNewtonSolver(self.mesh.mpi_comm(),
+                                                  momsolve.picard_params,
+                                                  momsolve.reuse_preconditioner)
+        self.newton_solver = MomentumNewtonSolver(self.mesh.mpi_comm(),
+                                                  momsolve.newton_params,
+                                                  momsolve.reuse_preconditioner)
+
         # Trial/Test Functions
         self.U = Function(self.V, name="U")
         self.U_np = Function(self.V, name="U_np")
@@ -113,6 +131,22 @@ class ssa_solver:
         self.eigenvals = None
         self.eigenfuncs = None
 
+        # Cached momentum forms (see def_mom_eq) & the equation built on them
+        self.mom_coeffs = None
+        self.mom_solver = None
+
+        # Observation operator for comp_J_inv (built on first use)
+        self.obs_op = None
+        self.reg_op = None
+        self.ddJ = None
+
+        # Cost function terms (see comp_J_inv & J_components)
+        self.J_terms = None
+
+        # Initial gradient norm for inexact momentum solves (see
+        # set_momsolve_tolerance)
+        self.g_norm_0 = None
+
     def set_inv_params(self):
 
         invparam = self.params.inversion
@@ -135,7 +169,26 @@ class ssa_solver:
         return qoi_dict[choice.lower()]  # flexible case
 
     def def_mom_eq(self):
-        """Define the momentum equation to be solved in solve_mom_eq"""
+        """
+        Define the momentum equation to be solved in solve_mom_eq
+
+        The weak form & its expanded Jacobians are only built once. On later
+        calls, if alpha and/or beta have been rebound to new Functions (e.g.
+        by forward_alpha), they are swapped into the existing forms, which
+        leaves the form signatures (and hence compiled kernels) unchanged.
+        The forms are rebuilt from scratch only if the thickness changes.
+        """
+        if self.mom_coeffs is not None and self.mom_coeffs[0] is self.H:
+            replace_map = {old: new for old, new in zip(self.mom_coeffs[1:],
+                                                        (self.alpha, self.beta))
+                           if old is not new}
+            if replace_map:
+                self.mom_F = ufl.replace(self.mom_F, replace_map)
+                self.mom_Jac_p = ufl.replace(self.mom_Jac_p, replace_map)
+                self.mom_Jac = ufl.replace(self.mom_Jac, replace_map)
+                self.mom_coeffs = (self.H, self.alpha, self.beta)
+                self.mom_solver = None
+            return
 
         # Simplify accessing fields and parameters
         constants = self.params.constants
@@ -272,6 +325,9 @@ class ssa_solver:
         self.mom_Jac = ufl.algorithms.expand_derivatives(
             derivative(self.mom_F, self.U))
 
+        self.mom_coeffs = (self.H, self.alpha, self.beta)
+        self.mom_solver = None
+
     def sliding_law(self, alpha, U):
 
         constants = self.params.constants
@@ -307,18 +363,25 @@ class ssa_solver:
 
         t0 = time.time()
 
-        newton_params = self.params.momsolve.newton_params
-        picard_params = self.params.momsolve.picard_params
-        J_p = self.mom_Jac_p
-
-        momsolver = MomentumSolver(self.mom_F == 0,
-                                   self.U,
-                                   bcs=self.flow_bcs,
-                                   J_p=J_p,
-                                   picard_params=picard_params,
-                                   solver_parameters=newton_params)
-
-        momsolver.solve(annotate=annotate_flag)
+        # The equation is reused until def_mom_eq changes the forms, or
+        # tlm_adjoint drops its references (e.g. on reset_manager)
+        if self.mom_solver is None or self.mom_solver.references_dropped:
+            newton_params = self.params.momsolve.newton_params
+            picard_params = self.params.momsolve.picard_params
+            J_p = self.mom_Jac_p
+
+            self.mom_solver = MomentumSolver(self.mom_F == 0,
+                                             self.U,
+                                             bcs=self.flow_bcs,
+                                             J_p=J_p,
+                                             picard_params=picard_params,
+                                             solver_parameters=newton_params,
+                                             cache_adjoint_jacobian=True,
+                                             cache_tlm_jacobian=True,
+                                             picard_solver=self.picard_solver,
+                                             newton_solver=self.newton_solver)
+
+        self.mom_solver.solve(annotate=annotate_flag)
 
         t1 = time.time()
         info("Time for solve: {0}".format(t1-t0))
@@ -406,12 +469,81 @@ class ssa_solver:
 
         H_s = self.H_s
         a, L = lhs(self.thickadv), rhs(self.thickadv)
-        solve(a == L, H_s, bcs=self.H_bcs)
+        self.thickadv_solver(a == L, H_s).solve()
 
     def solve_thickadv_split_eq(self):
         H_nps = self.H_nps
         a, L = lhs(self.thickadv_split), rhs(self.thickadv_split)
-        solve(a == L, H_nps, bcs=self.H_bcs)
+        self.thickadv_solver(a == L, H_nps).solve()
+
+    def thickadv_solver(self, eq, x):
+        """
+        Equation for a thickness advection step.
+
+        The adjoint (& TLM) Jacobians are cached: in a reverse sweep over
+        several QoI functionals (see timestep), each block's adjoint system
+        is then assembled & its solver set up once, and reused for every
+        functional.
+        """
+        return EquationSolver(eq, x, self.H_bcs,
+                              cache_adjoint_jacobian=True,
+                              cache_tlm_jacobian=True)
+
+    def checkpointing_params(self, n_steps):
+        """
+        Checkpointing method & parameters for tlm_adjoint, from the
+        [checkpointing] config section.
+
+        If 'ram_budget' (bytes per process) is set, snaps_in_ram is the
+        number of snapshots of the forward state (U, U_np, H_np, H_s, H_nps)
+        which fit within it.
+        """
+        cfg = self.params.checkpointing
+
+        if cfg.method == "memory":
+            return "memory", {}
+
+        snaps_in_ram = cfg.snaps_in_ram
+        if cfg.ram_budget is not None:
+            state = [self.U, self.U_np, self.H_np, self.H_s, self.H_nps]
+            snap_bytes = sum(8 * f.vector().local_size() for f in state)
+            snap_bytes = self.mesh.mpi_comm().allreduce(snap_bytes, op=MPI4PY.MAX)
+            snaps_in_ram = max(1, min(n_steps, cfg.ram_budget // snap_bytes))
+            info("Checkpointing: {0} snapshots of {1} bytes "
+                 "in RAM".format(snaps_in_ram, snap_bytes))
+
+        return "multistage", {"blocks": n_steps,
+                              "snaps_on_disk": cfg.snaps_on_disk,
+                              "snaps_in_ram": snaps_in_ram,
+                              "verbose": True,
+                              "path": cfg.path,
+                              "format": cfg.format}
+
+    def timestep_forward_only(self, save=1, qoi_func=None):
+        """
+        Run the time evolving model without tlm_adjoint: nothing is
+        annotated or checkpointed, so memory is limited to the working set.
+        Annotation is left off afterwards.
+
+        Returns the QoI time series (also in self.Qval_ts)
+        """
+        stop_manager()
+        self.timestep(save=save, adjoint_flag=0, qoi_func=qoi_func)
+        return self.Qval_ts
+
+    def output_due(self, n, n_steps, dt):
+        """
+        Whether to write the time series output after step n, every
+        'ts_output_every' steps or 'ts_output_years' years (io config), and
+        always at the final step.
+        """
+        io = self.params.io
+        if n == n_steps:
+            return True
+        if io.ts_output_years is not None:
+            return (np.floor(n * float(dt) / io.ts_output_years) >
+                    np.floor((n - 1) * float(dt) / io.ts_output_years))
+        return n % io.ts_output_every == 0
 
     def timestep(self, save=1, adjoint_flag=1, qoi_func=None ):
         """
@@ -425,8 +557,6 @@ class ssa_solver:
         dt = config.dt
         run_length = config.run_length
 
-        outdir = self.params.io.output_dir
-
         t = 0.0
 
         self.Qval_ts = np.zeros(n_steps+1)
@@ -449,11 +579,7 @@ class ssa_solver:
             reset_manager()
             start_annotating()
             # configure_checkpointing("periodic_disk", {'period': 2, "format":"pickle"})
-            configure_checkpointing("multistage", {"blocks": n_steps,
-                                                   "snaps_on_disk": 4000,
-                                                   "snaps_in_ram": 10,
-                                                   "verbose": True,
-                                                   "format": "pickle"})
+            configure_checkpointing(*self.checkpointing_params(n_steps))
 
         self.def_thickadv_eq()
         self.def_mom_eq()
@@ -474,16 +600,8 @@ class ssa_solver:
             new_block()
 
         if save:
-            Hfile = Path(outdir) / "_".join((self.params.io.run_name,
-                                             'H_ts.xdmf'))
-            Ufile = Path(outdir) / "_".join((self.params.io.run_name,
-                                             'U_ts.xdmf'))
-
-            xdmf_hts = XDMFFile(self.mesh.mpi_comm(), str(Hfile))
-            xdmf_uts = XDMFFile(self.mesh.mpi_comm(), str(Ufile))
-
-            xdmf_hts.write(H_np, 0.0)
-            xdmf_uts.write(U_np, 0.0)
+            ts_out = inout.TimeSeriesWriter(self.params, {"H": H_np, "U": U_np})
+            ts_out.write(0.0)
 
         ########################
         # Main timestepping loop
@@ -529,13 +647,11 @@ class ssa_solver:
                     else:
                         Q.addto()
 
-            if save:
-                xdmf_hts.write(H_np, t)
-                xdmf_uts.write(U_np, t)
+            if save and self.output_due(n, n_steps, dt):
+                ts_out.write(t)
 
         if save:
-            xdmf_hts.close()
-            xdmf_uts.close()
+            ts_out.close()
 
         manager_info()
         return Q_is if qoi_func is not None else None
@@ -619,20 +735,50 @@ class ssa_solver:
 
         return cntrl
 
-    def inversion(self):
+    def inversion(self, max_iter=None, checkpoint=None, resume=False):
+        """
+        Invert for the active controls. 'max_iter' overrides
+        inversion.max_iter (e.g. for the levels of a multilevel inversion).
 
+        If 'checkpoint' (an inout.InversionCheckpoint) is given, it is written
+        after each optimiser iteration & with 'resume' the inversion
+        continues from it.
+        """
         config = self.params.inversion
 
+        inv_options = dict(config.inv_options)
+        if max_iter is not None:
+            inv_options["maxiter"] = max_iter
+
         cntrl_input = self.get_control()
         nparam = len(cntrl_input)
+        joint = config.joint_cntrl and nparam > 1
+
+        num_iter = config.alt_iter*nparam if (nparam > 1 and not joint) else 1
 
-        num_iter = config.alt_iter*nparam if nparam > 1 else nparam
+        # L-BFGS curvature pairs per control, kept across alternations
+        lbfgs_history = {}
+        if config.keep_lbfgs_history:
+            lbfgs_history = {c.name(): LBFGSHistory(config.lbfgs_history_size)
+                             for c in cntrl_input}
 
-        for j in range(num_iter):
+        j_start, n_done = 0, 0
+        if resume:
+            assert checkpoint is not None, "Resuming requires a checkpoint"
+            state = checkpoint.read(self.inv_cntrl_functions(), lbfgs_history)
+            j_start, n_done = state["alt"], state["n_iter"]
+            info('Resuming inversion at iteration {0}/{1}, after {2} '
+                 'optimiser iterations'.format(j_start+1, num_iter, n_done))
+
+        for j in range(j_start, num_iter):
             info('Inversion iteration: {0}/{1}'.format(j+1,num_iter) )
 
             cntrl = cntrl_input[j % nparam]
-            if cntrl.name() == 'alpha':
+            if joint:
+                cc = [self.alpha, self.beta]
+                forward = self.forward_dual
+
+            elif cntrl.name() == 'alpha':
                 cc = self.alpha
                 if self.lumpedmass_inversion:
                     cc = self.alpha_l
@@ -643,22 +789,81 @@ class ssa_solver:
                 cc = self.beta
                 forward = self.forward_beta
 
-            reset_manager()
-            clear_caches()
-            start_annotating()
-            J = forward(cc)
-            stop_annotating()
+            # Iterations already done (if resuming part way through)
+            n_prev = n_done if j == j_start else 0
+            maxiter = inv_options["maxiter"] - n_prev
+
+            cntrl_fns = self.inv_cntrl_functions()
+            if joint:
+                cntrl_fns.update(zip(("alpha", "beta"), cc))
+            else:
+                cntrl_fns[cntrl.name()] = cc
+
+            def write_checkpoint(n_iter, alt=j):
+                if checkpoint is None:
+                    return
+                state = {"alt": alt, "n_iter": n_iter}
+                state.update(self.J_components())
+                checkpoint.write(state, cntrl_fns, lbfgs_history)
+
+            def callback(n_iter):
+                write_checkpoint(n_prev + n_iter)
+
+            if maxiter <= 0:
+                write_checkpoint(0, alt=j+1)
+                continue
+
+            # Inexact momentum solves: start loose, then tighten with |dJ|
+            grad_callback = None
+            if config.inexact_momsolve:
+                self.g_norm_0 = None
+                self.set_momsolve_tolerance(1.0)
+                grad_callback = self.inexact_grad_callback
 
             # dJ = compute_gradient(J, self.alpha)
             # ddJ = Hessian(forward)
             # min_order = taylor_test(forward, self.alpha, J_val=J.value(),
             #                         dJ=dJ, ddJ=ddJ, seed=1.0e-6)
 
-            cntrl_opt, result = minimize_scipy(forward, cc, J, method='L-BFGS-B',
-                                               options=config.inv_options)
+            # The other optimisers record their own initial forward run
+            if config.method == "newton-cg":
+                cntrl_opt, result = self.minimize_newton_cg(
+                    forward, cc, cntrl.name(), maxiter, callback=callback,
+                    grad_callback=grad_callback)
+            elif config.keep_lbfgs_history and not joint:
+                cntrl_opt, result = minimize_l_bfgs(
+                    forward, cc, lbfgs_history[cntrl.name()], maxiter=maxiter,
+                    gtol=config.gtol, ftol=config.ftol, callback=callback,
+                    grad_callback=grad_callback)
+            elif config.eval_cache_size > 0:
+                cntrl_opt, result = minimize_scipy_cached(
+                    forward, cc, cache_size=config.eval_cache_size,
+                    method='L-BFGS-B', options=dict(inv_options, maxiter=maxiter),
+                    callback=callback, grad_callback=grad_callback,
+                    cache_key=self.momsolve_tolerances)
+            else:
+                reset_manager()
+                clear_caches()
+                start_annotating()
+                J = forward(cc)
+                stop_annotating()
+
+                cntrl_opt, result = minimize_scipy(
+                    forward, cc, J, method='L-BFGS-B',
+                    options=dict(inv_options, maxiter=maxiter))
             # options = {"ftol":0.0, "gtol":1.0e-12, "disp":True, 'maxiter': 10})
 
-            cc.assign(cntrl_opt)
+            if joint:
+                for c, c_opt in zip(cc, cntrl_opt):
+                    c.assign(c_opt)
+            else:
+                cc.assign(cntrl_opt)
+
+            # Check the gradient with the configured tolerances (restored)
+            if config.inexact_momsolve:
+                self.check_inexact_gradient(forward, cc)
+
+            write_checkpoint(0, alt=j+1)
 
         self.def_mom_eq()
 
@@ -672,6 +877,126 @@ class ssa_solver:
         # Print out inversion results/parameter values
         self.J_inv = self.comp_J_inv(verbose=True)
 
+    def set_momsolve_tolerance(self, ratio=None):
+        """
+        Inexact inversion: loosen the momentum solve tolerances in proportion
+        to 'ratio', the gradient norm relative to the first in this
+        optimisation, i.e. the Newton relative tolerance is
+
+          max(inexact_rtol_max * ratio, newton relative_tolerance)
+
+        and likewise each stage's Krylov tolerance between its own configured
+        value & inexact_krylov_rtol_max. ratio=None restores the configured
+        tolerances.
+        """
+        config = self.params.inversion
+
+        if ratio is None:
+            self.picard_solver.scale_tolerances()
+            self.newton_solver.scale_tolerances()
+            return
+
+        rtol = self.newton_solver.rtol
+        factor = max(config.inexact_rtol_max * ratio, rtol) / rtol
+        factor = min(factor, max(config.inexact_rtol_max / rtol, 1.0))
+
+        # Each stage may have its own Krylov solver & tolerance
+        krylov_rtols = [slvr.inexact_krylov_rtol(
+                            ratio, config.inexact_krylov_rtol_max)
+                        for slvr in [self.picard_solver, self.newton_solver]]
+
+        self.picard_solver.scale_tolerances(krylov_rtol=krylov_rtols[0])
+        self.newton_solver.scale_tolerances(factor,
+                                            krylov_rtol=krylov_rtols[1])
+        info("Inexact momentum solve: Newton rtol %.3e, "
+             "Krylov rtol (Picard, Newton) %s, %s" %
+             ((rtol * factor,) +
+              tuple("-" if r is None else "%.3e" % r for r in krylov_rtols)))
+
+    def momsolve_tolerances(self):
+        """The current momentum solve tolerances, as a tuple"""
+        tols = []
+        for slvr in [self.picard_solver, self.newton_solver]:
+            params = slvr.newton.parameters
+            tols += [params["relative_tolerance"], params["absolute_tolerance"]]
+            if slvr.krylov:
+                tols.append(params["krylov_solver"]["relative_tolerance"])
+        return tuple(tols)
+
+    def inexact_grad_callback(self, g_norm):
+        """Gradient callback for the optimisers (see set_momsolve_tolerance)"""
+        if self.g_norm_0 is None:
+            self.g_norm_0 = g_norm
+        ratio = g_norm / self.g_norm_0 if self.g_norm_0 > 0.0 else 0.0
+        self.set_momsolve_tolerance(ratio)
+
+    def check_inexact_gradient(self, forward, cc):
+        """
+        Compare the gradient at the optimised control cc computed with the
+        current (inexact) & the configured momentum solve tolerances,
+        leaving the latter in place. Returns the relative discrepancy.
+        """
+        config = self.params.inversion
+
+        def gradient():
+            J = record_functional(forward, cc)
+            dJ = compute_gradient(J, cc)
+            if not isinstance(dJ, (list, tuple)):
+                dJ = [dJ]
+            return J.value(), [function_copy(d).vector() for d in dJ]
+
+        J_inexact, dJ_inexact = gradient()
+        self.set_momsolve_tolerance(None)
+        J_exact, dJ_exact = gradient()
+
+        diff, norm = 0.0, 0.0
+        for g_i, g_e in zip(dJ_inexact, dJ_exact):
+            g_i.axpy(-1.0, g_e)
+            diff = max(diff, g_i.norm("linf"))
+            norm = max(norm, g_e.norm("linf"))
+        rel = diff / norm if norm > 0.0 else 0.0
+
+        info("Inexact momentum solves: J %.8e (exact %.8e), relative "
+             "gradient discrepancy %.3e" % (J_inexact, J_exact, rel))
+        if rel > config.inexact_grad_rtol:
+            log.warning("Inexact momentum solves: gradient discrepancy %.3e "
+                        "exceeds inexact_grad_rtol (%.3e)" %
+                        (rel, config.inexact_grad_rtol))
+        return rel
+
+    def inv_cntrl_functions(self):
+        """The Functions optimised for alpha & beta, by name"""
+        alpha = self.alpha_l if self.lumpedmass_inversion else self.alpha
+        return {"alpha": alpha, "beta": self.beta}
+
+    def minimize_newton_cg(self, forward, cc, name, max_iter, callback=None,
+                           grad_callback=None):
+        """
+        Minimise forward(cc) by inexact Newton-CG (see optimize.py), with the
+        prior covariance for control 'name' (alpha or beta) as preconditioner
+        """
+        config = self.params.inversion
+        prior_cfg = self.params.prior
+
+        if name == 'alpha':
+            delta, gamma = config.delta_alpha, config.gamma_alpha
+        else:
+            delta, gamma = config.delta_beta, config.gamma_beta
+
+        reg_op = prior.laplacian(delta, gamma, cc.function_space(),
+                                 solver=prior_cfg.solver,
+                                 rtol=prior_cfg.rtol, atol=prior_cfg.atol)
+
+        result = minimize_newton_cg(forward, cc, reg_op.inv_action,
+                                    maxiter=max_iter,
+                                    gtol=config.gtol, ftol=config.ftol,
+                                    cg_maxiter=config.cg_max_iter,
+                                    eta_max=config.cg_eta_max,
+                                    callback=callback,
+                                    grad_callback=grad_callback)
+        reg_op.log_stats()
+        return result
+
     def epsilon(self, U):
         """Return the strain-rate tensor of self.U"""
         epsdot = sym(grad(U))
@@ -728,33 +1053,17 @@ class ssa_solver:
         do_alpha = invconfig.alpha_active
         do_beta = invconfig.beta_active
 
-        u, v = split(self.U)
-
-        # Observed velocities
-        u_obs = self.u_obs
-        v_obs = self.v_obs
-        u_std = self.u_std
-        v_std = self.v_std
-        uv_obs_pts = self.uv_obs_pts
-
-        # Determine observations within our mesh partition
-        # TODO find a faster way to do this
-        # TODO - this fails when obs points are vertices - is this a problem?
-
-        cell_max = self.mesh.cells().shape[0]
-        obs_local = np.zeros_like(u_obs, dtype=np.bool)
-
-        bbox = self.mesh.bounding_box_tree()
-        for i in range(uv_obs_pts.shape[0]):
-            p = Point(uv_obs_pts[i, 0], uv_obs_pts[i, 1])
-            obs_local[i] = bbox.compute_first_entity_collision(p) <= cell_max
-
-        local_cnt = np.sum(obs_local)
+        # Observations within our mesh partition, the space they live in and
+        # the interpolation matrices are only computed once
+        if self.obs_op is None:
+            self.obs_op = ObsOperator(self.V, self.uv_obs_pts,
+                                      self.u_obs, self.v_obs,
+                                      self.u_std, self.v_std)
+        obs_op = self.obs_op
 
         alpha = self.alpha
         beta = self.beta
         beta_bgd = self.beta_bgd
-        betadiff = beta-beta_bgd
 
         dIce = self.dIce
         # ds = self.ds
@@ -767,51 +1076,18 @@ class ssa_solver:
         gamma_b = self.gamma_beta
 
         # Sample Discrete Points
+        obs_space = obs_op.obs_space
+        u_obs_pts = obs_op.u_obs_pts
+        v_obs_pts = obs_op.v_obs_pts
+        u_std_pts = obs_op.u_std_pts
+        v_std_pts = obs_op.v_std_pts
 
-        # Arbitrary mesh to define function for interpolated variables
-        obs_mesh = UnitIntervalMesh(MPI.comm_self, local_cnt)
-        obs_space = FunctionSpace(obs_mesh, "Discontinuous Lagrange", 0)
-        u_obs_pts = Function(obs_space, name='u_obs_pts')
-        v_obs_pts = Function(obs_space, name='v_obs_pts')
-        u_std_pts = Function(obs_space, name='u_std_pts')
-        v_std_pts = Function(obs_space, name='v_std_pts')
-
-        u_obs_pts.vector()[:] = u_obs[obs_local]
-        v_obs_pts.vector()[:] = v_obs[obs_local]
-        u_std_pts.vector()[:] = u_std[obs_local]
-        v_std_pts.vector()[:] = v_std[obs_local]
-
-        u_obs_pts.vector().apply("insert")
-        v_obs_pts.vector().apply("insert")
-        u_std_pts.vector().apply("insert")
-        v_std_pts.vector().apply("insert")
-
-        # Interpolate from model
+        # Interpolate from model (point evaluation of the P1 velocity)
         u_pts = Function(obs_space, name='u_pts')
         v_pts = Function(obs_space, name='v_pts')
 
-        # TODO - is projection to M instead of Q OK here?
-        # it's necessary for InterpolationSolver to work
-        #
-        # Attempted to fix this (below) but causes an error
-        # in InterpolationSolver
-        uf = project(u, self.M)
-        vf = project(v, self.M)
-
-        # interp_space = FunctionSpace(self.mesh, 'DG', 1)
-        # uf = project(u, interp_space)
-        # vf = project(v, interp_space)
-
-        uf.rename("uf", "")
-        vf.rename("vf", "")
-
-        interper2 = InterpolationSolver(uf,
-                                        u_pts,
-                                        x_coords=uv_obs_pts[obs_local])
-        interper2.solve()
-        P = interper2._B[0]._A._P
-        P_T = interper2._B[0]._A._P_T
-        InterpolationSolver(vf, v_pts, P=P, P_T=P_T).solve()
+        ObsInterpolationSolver(self.U, u_pts, obs_op.P_u, obs_op.P_u_T).solve()
+        ObsInterpolationSolver(self.U, v_pts, obs_op.P_v, obs_op.P_v_T).solve()
 
         J = Functional(name="J")
 
@@ -839,21 +1115,21 @@ class ssa_solver:
 
         # Regularization
 
-        f = TrialFunction(self.Qp)
-        f_alpha = Function(self.Qp, name="f_alpha")
-        f_beta = Function(self.Qp, name="f_beta")
-
         # cf. Isaac 5, delta component -> invertiblity, gamma -> smoothness
-        a = f*self.pTau*dIce
+        # f = M^-1 K m, with M assembled & factorised (or lumped) only once
+        if self.reg_op is None:
+            self.reg_op = RegularisationOperator(self.Qp, dIce,
+                                                 invconfig.lumped_mass_reg)
+        reg_op = self.reg_op
+        dIce_reg = reg_op.dx_J
 
         if(do_alpha):
-            # This L is equivalent to scriptF in reg_operator.pdf
+            # This is equivalent to scriptF in reg_operator.pdf
             # Prior.py contains vector equivalent of this
-            # (this operates on fem functions)
-            L = (delta_a * alpha * self.pTau
-                 + gamma_a*inner(grad(alpha), grad(self.pTau)))*dIce
-            solve(a == L, f_alpha)
-            J_reg_alpha = 0.5 * inner(f_alpha, f_alpha)*dIce
+            f_alpha = Function(self.Qp, name="f_alpha")
+            RegularisationSolver(reg_op, delta_a, gamma_a,
+                                 alpha, f_alpha).solve()
+            J_reg_alpha = 0.5 * inner(f_alpha, f_alpha)*dIce_reg
             J.addto(J_reg_alpha)
 
             # if not self.f_alpha_file:
@@ -862,10 +1138,10 @@ class ssa_solver:
             # self.f_alpha_file << f_alpha
 
         if(do_beta):
-            L = (delta_b * betadiff * self.pTau
-                 + gamma_b*inner(grad(betadiff), grad(self.pTau)))*dIce
-            solve(a == L, f_beta)
-            J_reg_beta = 0.5 * inner(f_beta, f_beta)*dIce
+            f_beta = Function(self.Qp, name="f_beta")
+            RegularisationSolver(reg_op, delta_b, gamma_b,
+                                 beta, f_beta, m_bgd=beta_bgd).solve()
+            J_reg_beta = 0.5 * inner(f_beta, f_beta)*dIce_reg
             J.addto(J_reg_beta)
 
         # Continuous
@@ -894,8 +1170,27 @@ class ssa_solver:
             info('J_reg/J_cst: %.5e' % ((J3+J4)/(J2)))
             info('')
 
+        # For J_components
+        self.J_terms = (J_ls_term_new,
+                        J_reg_alpha if do_alpha else None,
+                        J_reg_beta if do_beta else None)
+
         return J
 
+    def J_components(self):
+        """The terms of the cost function from the last comp_J_inv"""
+        if self.J_terms is None:
+            return {}
+
+        J_ls, J_reg_alpha, J_reg_beta = self.J_terms
+        J_comp = {"J_ls": J_ls.values()[0],
+                  "J_reg_alpha": (0.0 if J_reg_alpha is None
+                                  else assemble(J_reg_alpha)),
+                  "J_reg_beta": (0.0 if J_reg_beta is None
+                                 else assemble(J_reg_beta))}
+        J_comp["J"] = sum(J_comp.values())
+        return J_comp
+
     def comp_Q_vaf(self, verbose=False):
         """QOI: Volume above flotation"""
         cnst = self.params.constants
@@ -955,11 +1250,34 @@ class ssa_solver:
         reset_manager()
         clear_caches()
         start_manager()
-        J = forward(cntrl[0])
+        J = forward(cntrl if len(cntrl) > 1 else cntrl[0])
         stop_manager()
 
         self.ddJ = SingleBlockHessian(J)
 
+    def hessian_block_action(self, cntrl, dM):
+        """
+        Apply the Hessian (see set_hessian_action) to each direction in the
+        list dM, returning a list of the results.
+
+        All k actions share the forward solution & its linearisation recorded
+        by set_hessian_action. The momentum TLM & adjoint Jacobians (and their
+        linear solvers/preconditioners) are cached by tlm_adjoint on the first
+        action and reused for the remaining k-1, so only the right hand sides
+        are reassembled per direction.
+        """
+        assert self.ddJ is not None, "Call set_hessian_action first"
+
+        t0 = time.time()
+        ddJ_block = []
+        for dm in dM:
+            _, _, ddJ_val = self.ddJ.action(cntrl, dm)
+            ddJ_block.append(function_copy(ddJ_val))
+
+        info("Time for {0} Hessian actions: {1}".format(len(dM),
+                                                        time.time() - t0))
+        return ddJ_block
+
     def save_ts_zero(self):
         self.H_init = Function(self.H_np.function_space())
         self.U_init = Function(self.U.function_space())
@@ -987,16 +1305,141 @@ class ddJ_wrapper(object):
         return self.ddJ_action(self.ddJ_F).vector().get_local()
 
 
+class MomentumNewtonProblem(NonlinearProblem):
+    """
+    NonlinearProblem for a single Picard/Newton stage of the momentum solve
+
+    Optionally marks the KSP to reuse its preconditioner after the first
+    Jacobian assembly, so e.g. the AMG hierarchy is only built once per stage.
+    """
+
+    def __init__(self, F, J, bcs, form_compiler_parameters=None, ksp=None):
+        NonlinearProblem.__init__(self)
+        self.assembler = SystemAssembler(J, F, bcs,
+                                         form_compiler_parameters=form_compiler_parameters)
+        self.ksp = ksp
+        self.n_jac = 0
+
+    def F(self, b, x):
+        self.assembler.assemble(b, x)
+
+    def J(self, A, x):
+        self.assembler.assemble(A)
+        if self.ksp is not None:
+            self.ksp.setReusePreconditioner(self.n_jac > 0)
+        self.n_jac += 1
+
+
+class MomentumNewtonSolver:
+    """
+    A dolfin NewtonSolver which persists between momentum solves
+
+    The NewtonSolver owns the Jacobian matrix & work vectors (so sparsity is
+    only computed once) and the linear solver (so the KSP/PC objects are only
+    created once). 'solver_parameters' takes the same form as the
+    picard_params/newton_params in MomsolveCfg. As for dolfin's solve(), an
+    unspecified (or 'default') linear_solver is LU.
+    """
+
+    def __init__(self, comm, solver_parameters, reuse_pc=False):
+        nonlinear_solver = solver_parameters.get('nonlinear_solver', 'newton')
+        assert nonlinear_solver == 'newton', \
+            "Momentum solver requires nonlinear_solver = 'newton', not '%s'" \
+            % nonlinear_solver
+
+        newton_params = dict(solver_parameters.get('newton_solver', {}))
+        method = newton_params.pop('linear_solver', 'default')
+        pc = newton_params.pop('preconditioner', 'default')
+
+        self.krylov = method != 'default' and has_krylov_solver_method(method)
+        if self.krylov:
+            self.linear_solver = PETScKrylovSolver(comm, method, pc)
+            self.reuse_pc = reuse_pc
+        else:
+            # Reusing a stale LU factorisation would change the solution,
+            # not just the convergence rate, so don't.
+            self.linear_solver = PETScLUSolver(comm, method)
+            self.reuse_pc = False
+
+        self.newton = NewtonSolver(comm, self.linear_solver, PETScFactory.instance())
+        self.newton.parameters.update(newton_params)
+
+        # Configured tolerances (see scale_tolerances). The NewtonSolver
+        # applies its 'krylov_solver' parameters to the linear solver on each
+        # solve, so the Krylov tolerance is read & set there.
+        self.rtol = self.newton.parameters["relative_tolerance"]
+        self.atol = self.newton.parameters["absolute_tolerance"]
+        self.krylov_rtol = None
+        if self.krylov:
+            self.krylov_rtol = \
+                self.newton.parameters["krylov_solver"]["relative_tolerance"]
+
+    def scale_tolerances(self, factor=1.0, krylov_rtol=None):
+        """
+        Loosen the Newton tolerances by 'factor' (>= 1) relative to those
+        configured & set the Krylov relative tolerance. The defaults restore
+        the configured tolerances.
+        """
+        self.newton.parameters["relative_tolerance"] = self.rtol * factor
+        self.newton.parameters["absolute_tolerance"] = self.atol * factor
+
+        if self.krylov:
+            if krylov_rtol is None:
+                # Unset by default, i.e. PETSc's default of 1e-5
+                krylov_rtol = self.krylov_rtol or 1.0e-5
+            self.newton.parameters["krylov_solver"]["relative_tolerance"] = \
+                krylov_rtol
+
+    def inexact_krylov_rtol(self, ratio, rtol_max):
+        """
+        The loosened Krylov relative tolerance, max(rtol_max * ratio, the
+        configured value) capped at max(rtol_max, the configured value), or
+        None for a direct solver.
+        """
+        if not self.krylov:
+            return None
+        krylov_base = self.krylov_rtol or 1.0e-5
+        return min(max(rtol_max * ratio, krylov_base),
+                   max(rtol_max, krylov_base))
+
+    def solve(self, F, x, bcs, J, form_compiler_parameters=None):
+        """Solve F(x) = 0 with Jacobian J, returning (iterations, converged)"""
+
+        # As NonlinearVariationalSolver, apply BCs to the initial guess
+        for bc in bcs:
+            bc.apply(x.vector())
+
+        ksp = self.linear_solver.ksp() if self.reuse_pc else None
+        problem = MomentumNewtonProblem(F, J, bcs,
+                                        form_compiler_parameters=form_compiler_parameters,
+                                        ksp=ksp)
+        return self.newton.solve(problem, x.vector())
+
+
 class MomentumSolver(EquationSolver):
 
     def __init__(self, *args, **kwargs):
         self.picard_params = kwargs.pop("picard_params", None)
         self.J_p = kwargs.pop("J_p", None)
+        self.picard_solver = kwargs.pop("picard_solver", None)
+        self.newton_solver = kwargs.pop("newton_solver", None)
         super(MomentumSolver, self).__init__(*args, **kwargs)
 
+        # Set by drop_references, after which the equation can't be solved
+        # again (see ssa_solver.solve_mom_eq)
+        self.references_dropped = False
+
+        # Fall back to (non-persistent) solvers if none are supplied
+        comm = self.x().function_space().mesh().mpi_comm()
+        if self.picard_solver is None:
+            self.picard_solver = MomentumNewtonSolver(comm, self.picard_params)
+        if self.newton_solver is None:
+            self.newton_solver = MomentumNewtonSolver(comm, self._solver_parameters)
+
     def drop_references(self):
         super().drop_references()
         self.J_p = replaced_form(self.J_p)
+        self.references_dropped = True
 
     def forward_solve(self, x, deps=None):
         if deps is None:
@@ -1021,23 +1464,248 @@ class MomentumSolver(EquationSolver):
             info("BC %i %i %.16e" % (i, len(keys), (values * values).sum()))
 
         lhs = replace_deps(self._lhs)
-        rhs = 0 if self._rhs == 0 else replace_deps(self._rhs)
+        F = lhs if self._rhs == 0 else lhs - replace_deps(self._rhs)
         J_p = replace_deps(self.J_p)
         J = replace_deps(self._J)
         # First order approx - inconsistent jacobian
         # 'replace_deps' is only used by forward replay - tlm_adjoint stuff
-        solve(lhs == rhs, x, self._bcs, J=J_p,
-              form_compiler_parameters=self._form_compiler_parameters,
-              solver_parameters=self.picard_params)
+        self.picard_solver.solve(F, x, self._bcs, J_p,
+                                 form_compiler_parameters=self._form_compiler_parameters)
         end()
 
         # Newton solver
-        solve(lhs == rhs, x, self._bcs, J=J,
-              form_compiler_parameters=self._form_compiler_parameters,
-              solver_parameters=self._solver_parameters)
+        self.newton_solver.solve(F, x, self._bcs, J,
+                                 form_compiler_parameters=self._form_compiler_parameters)
         end()
 
 
+class ObsOperator:
+    """
+    Maps model velocities onto the velocity observation points
+
+    Built once per mesh & set of observations (see ssa_solver.comp_J_inv).
+    Holds the observations lying in this process's cells, a DG0 space on
+    MPI.comm_self to hold them, and for each velocity component a sparse
+    matrix (& its transpose) which evaluates the vector P1 'space' at those
+    points, acting on the local (owned + ghost) values of a Function.
+    """
+
+    def __init__(self, space, uv_obs_pts, u_obs, v_obs, u_std, v_std):
+
+        assert space.ufl_element().degree() == 1, \
+            "Observation operator expects a P1 velocity space"
+
+        # Determine observations within our mesh partition
+        cells, bary = fice_mesh.locate_points(space.mesh(), uv_obs_pts)
+        self.obs_local = cells >= 0
+        self.local_cnt = int(np.sum(self.obs_local))
+        self.uv_obs_pts = uv_obs_pts[self.obs_local]
+
+        # Arbitrary mesh to define function for interpolated variables
+        obs_mesh = UnitIntervalMesh(MPI.comm_self, self.local_cnt)
+        self.obs_space = FunctionSpace(obs_mesh, "Discontinuous Lagrange", 0)
+
+        self.u_obs_pts = self.obs_function(u_obs, 'u_obs_pts')
+        self.v_obs_pts = self.obs_function(v_obs, 'v_obs_pts')
+        self.u_std_pts = self.obs_function(u_std, 'u_std_pts')
+        self.v_std_pts = self.obs_function(v_std, 'v_std_pts')
+
+        # P1 basis functions at a point are its barycentric coordinates,
+        # and the P1 cell dofs follow the cell's vertex ordering
+        cells, bary = cells[self.obs_local], bary[self.obs_local]
+        ucells, cell_idx = np.unique(cells, return_inverse=True)
+
+        with as_backend_type(Function(space).vector()).vec().localForm() as lf:
+            ncols = lf.getSize()
+
+        rows = np.repeat(np.arange(self.local_cnt), 3)
+        P = []
+        for i in range(2):
+            dofmap = space.sub(i).dofmap()
+            cell_dofs = np.array([dofmap.cell_dofs(c) for c in ucells],
+                                 dtype=np.int64).reshape(-1, 3)
+            P.append(sp.csr_matrix((bary.ravel(), (rows, cell_dofs[cell_idx].ravel())),
+                                   shape=(self.local_cnt, ncols)))
+
+        self.P_u, self.P_v = P
+        self.P_u_T = self.P_u.T.tocsr()
+        self.P_v_T = self.P_v.T.tocsr()
+
+    def obs_function(self, values, name):
+        """Return a (static) Function on obs_space holding the local values"""
+        f = Function(self.obs_space, name=name, static=True)
+        f.vector()[:] = values[self.obs_local]
+        f.vector().apply("insert")
+        return f
+
+
+class ObsInterpolationSolver(Equation):
+    """
+    Point evaluation of a Function: x = P y
+
+    P (see ObsOperator) acts on the local values of y *including* ghosts, so
+    points in a locally owned cell can be evaluated without communication.
+    The adjoint scatters P^T adj_x back onto the owning processes.
+    """
+
+    def __init__(self, y, x, P, P_T):
+        Equation.__init__(self, x, deps=[x, y], nl_deps=[],
+                          ic=False, adj_ic=False)
+        self._y_space = y.function_space()
+        self._P = P
+        self._P_T = P_T
+
+    def forward_solve(self, x, deps=None):
+        _, y = self.dependencies() if deps is None else deps
+
+        y_vec = as_backend_type(y.vector())
+        y_vec.update_ghost_values()
+        with y_vec.vec().localForm() as y_local:
+            function_set_values(x, self._P.dot(y_local.getArray(readonly=True)))
+
+    def adjoint_derivative_action(self, nl_deps, dep_index, adj_x):
+        if dep_index == 0:
+            return adj_x
+        else:
+            assert dep_index == 1
+            F = Function(self._y_space)
+            F_vec = as_backend_type(F.vector()).vec()
+            with F_vec.localForm() as F_local:
+                F_local.setArray(-self._P_T.dot(function_get_values(adj_x)))
+            F_vec.ghostUpdate(addv=PETSc.InsertMode.ADD,
+                              mode=PETSc.ScatterMode.REVERSE)
+            F_vec.ghostUpdate(addv=PETSc.InsertMode.INSERT,
+                              mode=PETSc.ScatterMode.FORWARD)
+            return F
+
+    def adjoint_jacobian_solve(self, adj_x, nl_deps, b):
+        return b
+
+    def tangent_linear(self, M, dM, tlm_map):
+        x, y = self.dependencies()
+        assert x not in M
+        tau_y = get_tangent_linear(y, M, dM, tlm_map)
+        if tau_y is None:
+            return NullSolver(tlm_map[x])
+        return ObsInterpolationSolver(tau_y, tlm_map[x], self._P, self._P_T)
+
+
+class RegularisationOperator:
+    """
+    Discrete form of the regularisation operator, f = M^-1 K m, where
+
+      K = delta * M + gamma * (grad, grad)
+
+    is the same operator as prior.laplacian's A. M is either the consistent
+    mass matrix (assembled & LU factorised once) or its row-sum diagonal.
+    K is assembled once per (delta, gamma) pair, so evaluating f and its
+    adjoint costs a matrix-vector product & a back substitution.
+
+    dx_J is the measure to use for 0.5 * f.f so that it equals 0.5 f^T M f
+    with the same M (vertex quadrature is exact lumping for P1).
+    """
+
+    def __init__(self, space, dx, lumped=False):
+        self.space = space
+        self.lumped = lumped
+
+        f = TrialFunction(space)
+        tau = TestFunction(space)
+        self._dx = dx
+
+        if lumped:
+            assert space.ufl_element().degree() == 1
+            self._M_l = assemble(tau * dx)
+            self.dx_J = dx(metadata={"quadrature_degree": 1,
+                                     "quadrature_rule": "vertex"})
+        else:
+            self._M = assemble(f * tau * dx)
+            self._M_solver = LUSolver(self._M)
+            self.dx_J = dx
+
+        self._K = {}
+
+    def stiffness(self, delta, gamma):
+        key = (float(delta), float(gamma))
+        if key not in self._K:
+            f = TrialFunction(self.space)
+            tau = TestFunction(self.space)
+            self._K[key] = assemble((delta * f * tau
+                                     + gamma * inner(grad(f), grad(tau)))
+                                    * self._dx)
+        return self._K[key]
+
+    def mass_solve(self, x, b):
+        """Solve M x = b"""
+        if self.lumped:
+            x.set_local(b.get_local() / self._M_l.get_local())
+            x.apply("insert")
+        else:
+            self._M_solver.solve(x, b)
+
+    def action(self, delta, gamma, m, f):
+        """f = M^-1 K m"""
+        b = Function(self.space).vector()
+        self.stiffness(delta, gamma).mult(m, b)
+        self.mass_solve(f, b)
+
+    def adjoint_action(self, delta, gamma, y, z):
+        """z = (M^-1 K)^T y = K M^-1 y"""
+        b = Function(self.space).vector()
+        self.mass_solve(b, y)
+        self.stiffness(delta, gamma).mult(b, z)
+
+
+class RegularisationSolver(Equation):
+    """
+    f = M^-1 K (m - m_bgd), see RegularisationOperator
+
+    m_bgd (optional) is treated as a constant background field.
+    """
+
+    def __init__(self, reg_op, delta, gamma, m, f, m_bgd=None):
+        Equation.__init__(self, f, deps=[f, m], nl_deps=[],
+                          ic=False, adj_ic=False)
+        self._reg_op = reg_op
+        self._delta = delta
+        self._gamma = gamma
+        self._m_bgd = m_bgd
+
+    def forward_solve(self, x, deps=None):
+        _, m = self.dependencies() if deps is None else deps
+
+        m_vec = m.vector()
+        if self._m_bgd is not None:
+            m_vec = m_vec.copy()
+            m_vec.axpy(-1.0, self._m_bgd.vector())
+
+        self._reg_op.action(self._delta, self._gamma, m_vec, x.vector())
+
+    def adjoint_derivative_action(self, nl_deps, dep_index, adj_x):
+        if dep_index == 0:
+            return adj_x
+        else:
+            assert dep_index == 1
+            F = function_new(adj_x)
+            self._reg_op.adjoint_action(self._delta, self._gamma,
+                                        adj_x.vector(), F.vector())
+            F_vec = F.vector()
+            F_vec *= -1.0
+            return F
+
+    def adjoint_jacobian_solve(self, adj_x, nl_deps, b):
+        return b
+
+    def tangent_linear(self, M, dM, tlm_map):
+        f, m = self.dependencies()
+        assert f not in M
+        tau_m = get_tangent_linear(m, M, dM, tlm_map)
+        if tau_m is None:
+            return NullSolver(tlm_map[f])
+        return RegularisationSolver(self._reg_op, self._delta, self._gamma,
+                                    tau_m, tlm_map[f])
+
+
 ########################################################
 # Lumped Mass Matrix stuff for variable mesh resolution
 ########################################################
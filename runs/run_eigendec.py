@@ -25,9 +25,8 @@ from tlm_adjoint_fenics import *
 from tlm_adjoint_fenics.eigendecomposition import PythonMatrix
 import pickle
 from pathlib import Path
-import datetime
 
-from fenics_ice import model, solver, prior, inout
+from fenics_ice import model, solver, prior, inout, eigendec
 from fenics_ice import mesh as fice_mesh
 from fenics_ice.config import ConfigParser
 from fenics_ice.decorators import count_calls, timer
@@ -105,7 +104,10 @@ def run_eigendec(config_file):
         delta = params.inversion.delta_beta
         gamma = params.inversion.gamma_beta
 
-    reg_op = prior.laplacian(delta, gamma, space)
+    reg_op = prior.laplacian(delta, gamma, space,
+                             solver=params.prior.solver,
+                             rtol=params.prior.rtol,
+                             atol=params.prior.atol)
 
     # Uncomment to get low-level SLEPc/PETSc output
     # set_log_level(10)
@@ -157,77 +159,159 @@ def run_eigendec(config_file):
                                             comm=comm)
         B_matrix.setUp()
 
+        # Restrict the search to the complement of the eigenvectors
+        # found by previous chunks (or a previous run)
+        if len(vr) > 0:
+            config.setDeflationSpace([as_backend_type(v.vector()).vec()
+                                      for v in vr])
+
         config.view()  # TODO - should this go to log?
         config.setOperators(A_matrix, B_matrix)
 
+    ev_file = os.path.join(outdir, params.io.eigenvecs_file)
+    lam_file = os.path.join(outdir, params.io.eigenvalue_file)
+
+    def save_eigenpairs(lam, vr, start):
+        """
+        Write eigenvectors vr[start:] to ev_file at offset start and all of
+        the eigenvalues so far to lam_file.
+
+        Writing at an explicit offset (rather than appending) discards any
+        vectors left beyond len(lam) by an interrupted run, so the two files
+        stay consistent on restart.
+        """
+        ev_out = inout.MultiVectorFile(ev_file, space,
+                                       'a' if start > 0 else 'w')
+        ev_out.append(vr[start:], start=start)
+
+        # Save eigenvals and some associated info - TODO HDF5File?
+        with open(lam_file, "wb") as pfile:
+            pickle.dump([lam, num_eig, n_iter, eig_algo, msft_flag, outdir, dd],
+                        pfile)
+
     # opts = {'prior': gnhep_prior_action, 'mass': gnhep_mass_action}
     # gnhep_func = opts[params.eigendec.precondition_by]
 
     num_eig = params.eigendec.num_eig
-    n_iter = params.eigendec.power_iter  # <- not used yet
+    n_iter = params.eigendec.power_iter  # <- random only
 
     # Hessian eigendecomposition using SLEPSc
     eig_algo = params.eigendec.eig_algo
+    vr = []
     if eig_algo == "slepc":
 
-        # Eigendecomposition
-        lam, vr = eigendecompose(space,
-                                 ghep_action,
-                                 tolerance=1.0e-10,
-                                 N_eigenvalues=num_eig,
-                                 problem_type=SLEPc.EPS.ProblemType.GHEP,
-                                 # solver_type=SLEPc.EPS.Type.ARNOLDI,
-                                 configure=slepc_config_callback)
-
-        # Check orthonormality of EVs
-        if num_eig is not None and num_eig < 100:
-
-            # Check for B (not B') orthogonality & normalisation
-            for i in range(num_eig):
-                reg_op.action(vr[i].vector(), xg.vector())
-                norm = xg.vector().inner(Vector(vr[i].vector())) ** 0.5
-                print("EV %s norm %s" % (i, norm))
-
-            for i in range(num_eig):
-                reg_op.action(vr[i].vector(), xg.vector())
-                for j in range(i+1, num_eig):
-                    inn = xg.vector().inner(Vector(vr[j].vector()))
-                    print("EV %s %s inner %s" % (i, j, inn))
-
-        # Uses extreme amounts of disk space; suitable for ismipc only
-        # #Save eigenfunctions
-        # vtkfile = File(os.path.join(outdir,'vr.pvd'))
-        # for v in vr:
-        #     v.rename('v', v.label())
-        #     vtkfile << v
-        #
-        # vtkfile = File(os.path.join(outdir,'vi.pvd'))
-        # for v in vi:
-        #     v.rename('v', v.label())
-        #     vtkfile << v
-
-        ev_file = params.io.eigenvecs_file
-        with HDF5File(slvr.mesh.mpi_comm(),
-                      os.path.join(outdir, ev_file), 'w') as hdf5file:
-            for i, v in enumerate(vr):
-                hdf5file.write(v, 'v', i)
-
-            hdf5file.parameters.add("num_eig", num_eig)
-            hdf5file.parameters.add("eig_algo", eig_algo)
-            hdf5file.parameters.add("timestamp", str(datetime.datetime.now()))
-
+        lam = np.zeros(0)
+
+        # Pick up the eigenpairs already streamed to disk
+        if params.eigendec.restart and os.path.isfile(lam_file):
+            with open(lam_file, 'rb') as pfile:
+                lam = pickle.load(pfile)[0]
+            vr = inout.MultiVectorFile(ev_file, space).read_functions(
+                slice(0, len(lam)))
+            log.info(f"Restarting eigendecomposition from {len(vr)} "
+                     "existing eigenpairs")
+
+        # Solve for (up to) chunk_size eigenpairs at a time, deflating
+        # those already found, and write each chunk as it is completed
+        chunk_size = params.eigendec.chunk_size
+        while num_eig is None or len(vr) < num_eig:
+            n_chunk = num_eig
+            if num_eig is not None:
+                n_chunk = num_eig - len(vr)
+                if chunk_size is not None:
+                    n_chunk = min(chunk_size, n_chunk)
+
+            # Eigendecomposition
+            lam_chunk, vr_chunk = eigendecompose(
+                space,
+                ghep_action,
+                tolerance=1.0e-10,
+                N_eigenvalues=n_chunk,
+                problem_type=SLEPc.EPS.ProblemType.GHEP,
+                # solver_type=SLEPc.EPS.Type.ARNOLDI,
+                configure=slepc_config_callback)
+
+            if n_chunk is not None:
+                lam_chunk, vr_chunk = lam_chunk[:n_chunk], vr_chunk[:n_chunk]
+
+            start = len(vr)
+            lam = np.concatenate((lam, lam_chunk))
+            vr.extend(vr_chunk)
+            save_eigenpairs(lam, vr, start)
+            log.info(f"Eigenpairs {start} to {len(vr) - 1} written")
+
+            if num_eig is None or len(vr_chunk) == 0:
+                break
+
+    elif eig_algo == "random":
+
+        assert num_eig is not None, "'num_eig' is required for eig_algo 'random'"
+
+        def hessian_block_action(X):
+            dM = []
+            for i in range(X.shape[1]):
+                dm = Function(space)
+                function_set_values(dm, X[:, i])
+                dM.append(dm)
+            ddJ = slvr.hessian_block_action(cntrl, dM)
+            return np.stack([function_get_values(y) for y in ddJ], axis=1)
+
+        lam, U = eigendec.randomized_ghep(
+            slvr.mesh.mpi_comm(),
+            hessian_block_action,
+            reg_op.action_block,
+            reg_op.inv_action_block,
+            xb.vector().local_size(), num_eig,
+            n_oversample=params.eigendec.oversampling,
+            power_iter=n_iter,
+            seed=params.eigendec.random_seed)
+
+        for i in range(num_eig):
+            v = Function(space)
+            function_set_values(v, U[:, i])
+            vr.append(v)
+
+        save_eigenpairs(lam, vr, 0)
 
     else:
         raise NotImplementedError
 
+    # SLEPc may converge fewer eigenpairs than requested
+    if num_eig is not None and len(vr) < num_eig:
+        log.warning(f"Only {len(vr)} of the {num_eig} requested eigenpairs "
+                    "were found")
+
+    # Check orthonormality of EVs
+    if num_eig is not None and num_eig < 100:
+
+        # Check for B (not B') orthogonality & normalisation
+        for i in range(len(vr)):
+            reg_op.action(vr[i].vector(), xg.vector())
+            norm = xg.vector().inner(Vector(vr[i].vector())) ** 0.5
+            print("EV %s norm %s" % (i, norm))
+
+        for i in range(len(vr)):
+            reg_op.action(vr[i].vector(), xg.vector())
+            for j in range(i+1, len(vr)):
+                inn = xg.vector().inner(Vector(vr[j].vector()))
+                print("EV %s %s inner %s" % (i, j, inn))
+
+    # Uses extreme amounts of disk space; suitable for ismipc only
+    # #Save eigenfunctions
+    # vtkfile = File(os.path.join(outdir,'vr.pvd'))
+    # for v in vr:
+    #     v.rename('v', v.label())
+    #     vtkfile << v
+    #
+    # vtkfile = File(os.path.join(outdir,'vi.pvd'))
+    # for v in vi:
+    #     v.rename('v', v.label())
+    #     vtkfile << v
+
     slvr.eigenvals = lam
     slvr.eigenfuncs = vr
 
-    # Save eigenvals and some associated info - TODO HDF5File?
-    fileout = params.io.eigenvalue_file
-    pfile = open(os.path.join(outdir, fileout), "wb")
-    pickle.dump([lam, num_eig, n_iter, eig_algo, msft_flag, outdir, dd], pfile)
-    pfile.close()
+    reg_op.log_stats()
 
     # Plot of eigenvals
     lamr = lam.real
@@ -0,0 +1,150 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from pathlib import Path
+import numpy as np
+import h5py
+
+from fenics import *
+from tlm_adjoint_fenics import *
+
+from fenics_ice import model, solver, inout
+from fenics_ice import mesh as fice_mesh
+from fenics_ice.config import ConfigParser
+
+stop_annotating()
+
+def run_ensemble(config_file):
+    """
+    Run an ensemble of forward-only simulations, writing the QoI time
+    series of every member to one file (io.ensemble_file).
+
+    MPI.comm_world is split into 'n_groups' sub-communicators, each of which
+    loads the model once and then runs its share of the members in turn.
+    """
+
+    # Read run config file
+    params = ConfigParser(config_file)
+    log = inout.setup_logging(params)
+    inout.log_preamble("ensemble", params)
+
+    ens = params.ensemble
+    outdir = params.io.output_dir
+
+    world = MPI.comm_world
+    n_groups = ens.n_groups
+    assert world.size >= n_groups, "More groups than processes"
+
+    # Contiguous blocks of ranks form each group
+    group = (world.rank * n_groups) // world.size
+    comm = world.Split(color=group, key=world.rank)
+
+    # Load the static model data (geometry, smb, etc)
+    input_data = inout.InputData(params)
+
+    # Get model mesh on this group's communicator
+    mesh = fice_mesh.get_mesh(params, comm=comm)
+
+    # Define the model
+    mdl = model.model(mesh, input_data, params)
+
+    mdl.alpha_from_inversion()
+    mdl.beta_from_inversion()
+
+    slvr = solver.ssa_solver(mdl)
+    slvr.save_ts_zero()
+
+    qoi_func = slvr.get_qoi_func()
+
+    # Define the members
+    samples = None
+    if ens.samples_file is not None:
+        samples = inout.MultiVectorFile(Path(outdir) / ens.samples_file,
+                                        mdl.Qp)
+
+    n_members = ens.n_members
+    if n_members is None:
+        if samples is not None:
+            n_members = samples.num_vectors()
+        else:
+            n_members = max(len(ens.smb_scale or []),
+                            len(ens.bmelt_scale or []))
+    assert n_members > 0, "Unable to determine the number of ensemble members"
+
+    for name in ["smb_scale", "bmelt_scale"]:
+        scale = getattr(ens, name)
+        assert not scale or len(scale) == n_members, \
+            f"Ensemble '{name}' has {len(scale)} entries, expected {n_members}"
+
+    cntrl = slvr.alpha if ens.samples_cntrl == "alpha" else slvr.beta
+    cntrl_0 = cntrl.vector().get_local()
+    smb_0 = slvr.smb.vector().get_local()
+    bmelt_0 = slvr.bmelt.vector().get_local()
+
+    def set_field(f, values):
+        f.vector().set_local(values)
+        f.vector().apply("insert")
+
+    # Fields are updated in place. timestep redefines the equations for
+    # each member, but with unchanged form signatures, so the generated
+    # code is taken from the JIT cache rather than recompiled
+    Qvals = {}
+    for m in range(group, n_members, n_groups):
+        log.info(f"Ensemble member {m} of {n_members} (group {group})")
+
+        slvr.reset_ts_zero()
+
+        set_field(cntrl, cntrl_0 if samples is None
+                  else samples.read(slice(m, m + 1))[:, 0])
+        set_field(slvr.smb, smb_0 * (ens.smb_scale[m] if ens.smb_scale
+                                     else 1.0))
+        set_field(slvr.bmelt, bmelt_0 * (ens.bmelt_scale[m] if ens.bmelt_scale
+                                         else 1.0))
+
+        Qvals[m] = slvr.timestep_forward_only(save=0,
+                                              qoi_func=qoi_func).copy()
+
+    # Consolidate on rank 0
+    if comm.rank != 0:
+        Qvals = {}
+    Qvals = world.gather(Qvals, root=0)
+
+    if world.rank == 0:
+        Qval_all = {}
+        for q in Qvals:
+            Qval_all.update(q)
+
+        run_length = params.time.run_length
+        n_steps = params.time.total_steps
+
+        with h5py.File(Path(outdir) / params.io.ensemble_file, 'w') as f:
+            f.create_dataset("t", data=np.linspace(0, run_length, n_steps+1))
+            f.create_dataset("Qval", data=np.stack([Qval_all[m] for m in
+                                                    range(n_members)]))
+            f.attrs["qoi"] = params.error_prop.qoi
+            f.attrs["n_groups"] = n_groups
+
+    world.barrier()
+    return mdl
+
+
+if __name__ == "__main__":
+    stop_annotating()
+
+    assert len(sys.argv) == 2, "Expected a configuration file (*.toml)"
+    run_ensemble(sys.argv[1])
@@ -73,73 +73,76 @@ def run_errorprop(config_file):
         log.warning("Dual inversion but error propagation isn't implemented yet!"
                     "Doing alpha only!")
 
-    reg_op = prior.laplacian(delta, gamma, cntrl.function_space())
+    reg_op = prior.laplacian(delta, gamma, cntrl.function_space(),
+                             solver=params.prior.solver,
+                             rtol=params.prior.rtol,
+                             atol=params.prior.atol)
 
     space = cntrl.function_space()
-    x, y, z = [Function(space) for i in range(3)]
+    y, z = Function(space), Function(space)
 
     # Loads eigenvalues from file
     with open(os.path.join(outdir, lamfile), 'rb') as ff:
         eigendata = pickle.load(ff)
         lam = eigendata[0].real.astype(np.float64)
-        nlam = len(lam)
-
-    # and eigenvectors from .h5 file
-    eps = params.constants.float_eps
-    W = []
-    with HDF5File(MPI.comm_world, os.path.join(outdir, vecfile), 'r') as hdf5data:
-        for i in range(nlam):
-            w = Function(space)
-            hdf5data.read(w, f'v/vector_{i}')
-
-            # Test norm in prior == 1.0
-            reg_op.action(w.vector(), y.vector())
-            norm_in_prior = w.vector().inner(y.vector())
-            assert (abs(norm_in_prior - 1.0) < eps)
-
-            W.append(w)
 
     # take only the largest eigenvalues
     pind = np.flatnonzero(lam > threshlam)
     lam = lam[pind]
-    W = [W[i] for i in pind]
+    D = lam / (lam + 1)  # D_r Isaac 20
 
-    D = np.diag(lam / (lam + 1))  # D_r Isaac 20
+    comm = MPI.comm_world
 
     # File containing dQoi_dCntrl (i.e. Jacobian of parameter to observable (Qoi))
-    hdf5data = HDF5File(MPI.comm_world, os.path.join(outdir, dqoi_h5file), 'r')
+    hdf5data = HDF5File(comm, os.path.join(outdir, dqoi_h5file), 'r')
 
     dQ_cntrl = Function(space)
 
     run_length = params.time.run_length
     num_sens = params.time.num_sens
     t_sens = np.flip(np.linspace(run_length, 0, num_sens))
-    sigma = np.zeros(num_sens)
-    sigma_prior = np.zeros(num_sens)
-
+    # All the QoI sensitivities as an (n_local, num_sens) block
+    dQ = np.zeros((dQ_cntrl.vector().local_size(), num_sens))
     for j in range(num_sens):
         hdf5data.read(dQ_cntrl, f'dQd{cntrl.name()}/vector_{j}')
+        dQ[:, j] = dQ_cntrl.vector().get_local()
 
-        # TODO - is a mass matrix operation required here?
-        # qd_cntrl - should be gradients
-        tmp1 = np.asarray([w.vector().inner(dQ_cntrl.vector()) for w in W])
-        tmp2 = np.dot(D, tmp1)
-
-        P1 = Function(space)
-        for tmp, w in zip(tmp2, W):
-            P1.vector().axpy(tmp, w.vector())
+    # Prior only: all samples in one block solve
+    P2 = reg_op.inv_action_block(dQ)
+    sigma_prior = comm.allreduce(np.sum(dQ * P2, axis=0))
 
-        reg_op.inv_action(dQ_cntrl.vector(), x.vector())
-        P2 = x  # .vector().get_local()
+    # Low rank update (Isaac 20): q^T W D W^T q for each sample, streaming
+    # the eigenvectors in chunks of 'eig_chunk_size' modes
+    # TODO - is a mass matrix operation required here?
+    # qd_cntrl - should be gradients
+    eps = params.constants.float_eps
+    check_norm = params.error_prop.check_prior_norm
+    chunk_size = params.error_prop.eig_chunk_size or max(len(pind), 1)
+
+    ev_file = inout.MultiVectorFile(os.path.join(outdir, vecfile), space)
+    variance_lr = np.zeros(num_sens)
+    for c0 in range(0, len(pind), chunk_size):
+        c_ind = pind[c0:c0 + chunk_size]
+        if np.all(np.diff(c_ind) == 1):
+            c_ind = slice(c_ind[0], c_ind[-1] + 1)
+        W = ev_file.read(c_ind)
+
+        if check_norm:
+            # Test norm in prior == 1.0
+            for i in range(W.shape[1]):
+                y.vector().set_local(W[:, i])
+                y.vector().apply("insert")
+                reg_op.action(y.vector(), z.vector())
+                norm_in_prior = y.vector().inner(z.vector())
+                assert (abs(norm_in_prior - 1.0) < eps)
 
-        P_vec = P2.vector() - P1.vector()
+        WtdQ = comm.allreduce(W.T.dot(dQ))
+        variance_lr += D[c0:c0 + chunk_size].dot(WtdQ**2)
 
-        variance = P_vec.inner(dQ_cntrl.vector())
-        sigma[j] = np.sqrt(variance)
+    sigma = np.sqrt(sigma_prior - variance_lr)
+    sigma_prior = np.sqrt(sigma_prior)
 
-        # Prior only
-        variance_prior = P2.vector().inner(dQ_cntrl.vector())
-        sigma_prior[j] = np.sqrt(variance_prior)
+    reg_op.log_stats()
 
     # Test that eigenvectors are prior inverse orthogonal
     # y.vector().set_local(W[:,398])
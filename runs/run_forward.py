@@ -15,7 +15,6 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys
 import os
 from pathlib import Path
 import argparse
@@ -37,7 +36,12 @@ from IPython import embed
 
 stop_annotating()
 
-def run_forward(config_file):
+def run_forward(config_file, forward_only=False):
+    """
+    Run the forward model & the adjoint to get dQoi/dCntrl at each of the
+    'num_sens' times. With forward_only, just compute the QoI time series
+    (no annotation, checkpointing or adjoint).
+    """
 
     #Read run config file
     params = ConfigParser(config_file)
@@ -66,11 +70,18 @@ def run_forward(config_file):
 
     qoi_func = slvr.get_qoi_func()
 
+    if forward_only:
+        slvr.timestep_forward_only(qoi_func=qoi_func)
+        inout.write_qval(slvr.Qval_ts, params)
+        return mdl
+
     #TODO here - cntrl now returns a list - so compute_gradient returns a list of tuples
 
     #Run the forward model
     Q = slvr.timestep(adjoint_flag=1, qoi_func=qoi_func)
     #Run the adjoint model, computing gradient of Qoi w.r.t cntrl
+    #All num_sens functionals share one reverse sweep (and the adjoint
+    #Jacobian of each block), so don't split this into separate calls
     dQ_ts = compute_gradient(Q, cntrl) #Isaac 27
 
     #Uncomment for Taylor Verification, Comment above two lines
@@ -109,5 +120,11 @@ def run_forward(config_file):
 if __name__ == "__main__":
     stop_annotating()
 
-    assert len(sys.argv) == 2, "Expected a configuration file (*.toml)"
-    run_forward(sys.argv[1])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_file", help="Configuration file (*.toml)")
+    parser.add_argument("--forward-only", dest="forward_only",
+                        action="store_true",
+                        help="Only compute the QoI time series (no adjoint)")
+    args = parser.parse_args()
+
+    run_forward(args.config_file, forward_only=args.forward_only)
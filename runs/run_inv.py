@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys
+import argparse
 from pathlib import Path
 from dolfin import *
 from tlm_adjoint_fenics import *
@@ -33,45 +33,94 @@ from fenics_ice.config import ConfigParser
 import datetime
 
 
-def run_inv(config_file):
-    """Run the inversion part of the simulation"""
+def run_inv(config_file, resume=False):
+    """
+    Run the inversion part of the simulation
+
+    With resume, continue from the inversion checkpoint file (see
+    inversion.checkpoint)
+    """
     # Read run config file
     params = ConfigParser(config_file)
 
-    inout.setup_logging(params)
+    log = inout.setup_logging(params)
     inout.log_preamble("inverse", params)
 
+    inv_cfg = params.inversion
+    outdir = params.io.output_dir
+
     # Load the static model data (geometry, smb, etc)
     input_data = inout.InputData(params)
 
-    # Get the model mesh
-    mesh = fice_mesh.get_mesh(params)
-    mdl = model.model(mesh, input_data, params)
-
-    # pts_lengthscale = params.obs.pts_len
-
-    mdl.gen_alpha()
-
-    # Add random noise to Beta field iff we're inverting for it
-    mdl.bglen_from_data()
-    mdl.init_beta(mdl.bglen_to_beta(mdl.bglen), params.inversion.beta_active)
-
-    # Next line will output the initial guess for alpha fed into the inversion
-    # File(os.path.join(outdir,'alpha_initguess.pvd')) << mdl.alpha
-
-    #####################
-    # Run the Inversion #
-    #####################
-
-    slvr = solver.ssa_solver(mdl)
-    slvr.inversion()
+    # Multilevel: invert on each coarse mesh in turn, then the target mesh,
+    # each level starting from the (interpolated) result of the previous one
+    levels = list(inv_cfg.coarse_meshes or []) + [None]
+    bc_files = list(inv_cfg.coarse_bc_files or
+                    [None] * (len(levels) - 1)) + [None]
+
+    ckpt_file = Path(outdir) / params.io.inv_checkpoint_file
+    start_level = 0
+    if resume:
+        assert ckpt_file.exists(), "No checkpoint to resume from: %s" % ckpt_file
+        start_level = inout.InversionCheckpoint.read_state(ckpt_file)["level"]
+
+    prev_cntrl = None
+    for i, (mesh_filename, bc_filename) in enumerate(zip(levels, bc_files)):
+        if i < start_level:
+            continue
+        final_level = (i == len(levels) - 1)
+        log.info("Inversion level %d of %d, mesh: %s" %
+                 (i + 1, len(levels),
+                  params.mesh.mesh_filename if final_level else mesh_filename))
+
+        # Get the model mesh (& its boundary markers, if any)
+        mesh = fice_mesh.get_mesh(params, mesh_filename=mesh_filename)
+        mdl = model.model(mesh, input_data, params, bc_filename=bc_filename)
+
+        # pts_lengthscale = params.obs.pts_len
+
+        mdl.gen_alpha()
+
+        # Add random noise to Beta field iff we're inverting for it
+        mdl.bglen_from_data()
+        mdl.init_beta(mdl.bglen_to_beta(mdl.bglen), inv_cfg.beta_active)
+
+        # Initial guess for the active controls from the previous level
+        # (or the warm start file)
+        if prev_cntrl is None and inv_cfg.warm_start_file is not None \
+           and not resume:
+            prev_cntrl = mdl.cntrl_from_file(
+                Path(outdir) / inv_cfg.warm_start_file, inv_cfg.warm_start_mesh)
+        if prev_cntrl is not None:
+            alpha_prev, beta_prev = prev_cntrl
+            mdl.cntrl_from_functions(
+                alpha_prev if inv_cfg.alpha_active else None,
+                beta_prev if inv_cfg.beta_active else None)
+
+        # Next line will output the initial guess for alpha fed into the inversion
+        # File(os.path.join(outdir,'alpha_initguess.pvd')) << mdl.alpha
+
+        #####################
+        # Run the Inversion #
+        #####################
+
+        checkpoint = None
+        if inv_cfg.checkpoint or resume:
+            checkpoint = inout.InversionCheckpoint(ckpt_file, mesh.mpi_comm(),
+                                                   level=i)
+
+        slvr = solver.ssa_solver(mdl)
+        slvr.inversion(max_iter=None if final_level
+                       else inv_cfg.coarse_max_iter,
+                       checkpoint=checkpoint,
+                       resume=(resume and i == start_level))
+
+        prev_cntrl = (mdl.alpha, mdl.beta)
 
     ###########################
     #  Write out variables    #
     ###########################
 
-    outdir = params.io.output_dir
-
     # Required for next phase (HDF5):
 
     invout_file = params.io.inversion_file
@@ -85,6 +134,7 @@ def run_inv(config_file):
 
     invout.write(mdl.alpha, 'alpha')
     invout.write(mdl.beta, 'beta')
+    invout.write(mesh, 'mesh')  # for warm starts on other meshes
 
     # For visualisation (XML & VTK):
 
@@ -127,5 +177,11 @@ def run_inv(config_file):
 
 if __name__ == "__main__":
     stop_annotating()
-    assert len(sys.argv) == 2, "Expected a configuration file (*.toml)"
-    run_inv(sys.argv[1])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_file", help="Configuration file (*.toml)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from the inversion checkpoint file")
+    args = parser.parse_args()
+
+    run_inv(args.config_file, resume=args.resume)
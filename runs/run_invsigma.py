@@ -77,9 +77,12 @@ def run_invsigma(config_file):
 
     space = cntrl.function_space()
 
-    sigma, sigma_prior, x, y, z = [Function(space) for i in range(5)]
+    sigma, sigma_prior, x, y = [Function(space) for i in range(4)]
 
-    reg_op = prior.laplacian(delta, gamma, space)
+    reg_op = prior.laplacian(delta, gamma, space,
+                             solver=params.prior.solver,
+                             rtol=params.prior.rtol,
+                             atol=params.prior.atol)
 
     # Load the eigenvalues
     with open(os.path.join(eigendir, lamfile), 'rb') as ff:
@@ -90,77 +93,52 @@ def run_invsigma(config_file):
     # Read in the eigenvectors and check they are normalised
     # w.r.t. the prior (i.e. the B matrix in our GHEP)
     eps = params.constants.float_eps
-    W = []
-    with HDF5File(comm,
-                  os.path.join(eigendir, vecfile), 'r') as hdf5data:
-        for i in range(nlam):
-            w = Function(space)
-            hdf5data.read(w, f'v/vector_{i}')
-
-            # Test norm in prior == 1.0
-            reg_op.action(w.vector(), y.vector())
-            norm_in_prior = w.vector().inner(y.vector())
-            assert (abs(norm_in_prior - 1.0) < eps)
-
-            W.append(w)
+    W_local = inout.MultiVectorFile(os.path.join(eigendir, vecfile),
+                                    space).read(slice(0, nlam))
+    for i in range(nlam):
+        # Test norm in prior == 1.0
+        y.vector().set_local(W_local[:, i])
+        y.vector().apply("insert")
+        reg_op.action(y.vector(), x.vector())
+        norm_in_prior = y.vector().inner(x.vector())
+        assert (abs(norm_in_prior - 1.0) < eps)
 
     # Which eigenvalues are larger than our threshold?
     pind = np.flatnonzero(lam > threshlam)
     lam = lam[pind]
-    W = [W[i] for i in pind]
-
-    D = np.diag(lam / (lam + 1))
-
-    neg_flag = 0
+    W_local = W_local[:, pind]
 
     # Isaac Eq. 20
     # P2 = prior
     # P1 = WDW
     # Note - don't think we're considering the cross terms
     # in the posterior covariance.
-    # TODO - this isn't particularly well parallelised - can it be improved?
-    for j in range(space.dim()):
-
-        # Who owns this index?
-        own_idx = y.vector().owns_index(j)
-        ownership = np.where(comm.allgather(own_idx))[0]
-        assert len(ownership) == 1
-        idx_root  = ownership[0]
+    # Only the diagonals are needed: that of P1 is a row-wise weighted sum of
+    # squares of the (locally owned) eigenvector block.
+    P1_diag = (W_local**2).dot(lam / (lam + 1))
 
-        y.vector().zero()
-        y.vector().vec().setValue(j, 1.0)
-        y.vector().apply('insert')
+    invsigma = params.inv_sigma
+    P2_diag = reg_op.inv_action_diagonal(method=invsigma.prior_diag,
+                                         n_samples=invsigma.prior_diag_samples,
+                                         seed=invsigma.random_seed)
 
-        tmp2 = np.asarray([D[i, i] * w.vector().vec().getValue(j) for i, w in enumerate(W)])
-        tmp2 = comm.bcast(tmp2, root=idx_root)
+    P_diag = P2_diag - P1_diag
 
-        P1 = Function(space)
-        for tmp, w in zip(tmp2, W):
-            P1.vector().axpy(tmp, w.vector())
-
-        reg_op.inv_action(y.vector(), x.vector())
-        P2 = x
-
-        P_vec = P2.vector() - P1.vector()
-
-        dprod = comm.bcast(P_vec.vec().getValue(j), root=idx_root)
-        dprod_prior = comm.bcast(P2.vector().vec().getValue(j), root=idx_root)
-
-        if dprod < 0:
-            log.warning(f'WARNING: Negative Sigma: {dprod}')
-            log.warning('Setting as Zero and Continuing.')
-            neg_flag = 1
-            continue
+    neg = P_diag < 0
+    num_neg = comm.allreduce(int(np.count_nonzero(neg)))
+    neg_flag = num_neg > 0
+    if neg_flag:
+        log.warning(f'WARNING: {num_neg} Negative Sigma(s), min: '
+                    f'{min(comm.allgather(P_diag.min(initial=0.0)))}')
+        log.warning('Setting as Zero and Continuing.')
 
-        sigma.vector().vec().setValue(j, np.sqrt(dprod))
-        sigma_prior.vector().vec().setValue(j, np.sqrt(dprod_prior))
+    sigma.vector().set_local(np.sqrt(np.where(neg, 0.0, P_diag)))
+    sigma_prior.vector().set_local(np.sqrt(np.where(neg, 0.0, P2_diag)))
 
     sigma.vector().apply("insert")
     sigma_prior.vector().apply("insert")
 
-    # For testing - whole thing at once:
-    # wdw = (np.matrix(W) * np.matrix(D) * np.matrix(W).T)
-    # wdw[:,0] == P1 for j = 0
+    reg_op.log_stats()
 
     if neg_flag:
         log.warning('Negative value(s) of sigma encountered.'
@@ -0,0 +1,123 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import os
+import pickle
+import numpy as np
+
+from dolfin import *
+from tlm_adjoint import *
+
+from fenics_ice import model, prior, inout, sample
+from fenics_ice import mesh as fice_mesh
+from fenics_ice.config import ConfigParser
+
+def run_sample(config_file):
+    """
+    Draw samples of the control from the Laplace approximation to the
+    posterior (or the prior), writing them to io.samples_file as an
+    inout.MultiVectorFile (e.g. for run_ensemble).
+    """
+
+    comm = MPI.comm_world
+
+    # Read run config file
+    params = ConfigParser(config_file)
+
+    # Setup logging
+    log = inout.setup_logging(params)
+    inout.log_preamble("sample", params)
+
+    outdir = params.io.output_dir
+    sample_cfg = params.sample
+
+    # Load the static model data (geometry, smb, etc)
+    input_data = inout.InputData(params)
+
+    # Get model mesh
+    mesh = fice_mesh.get_mesh(params)
+
+    # Define the model (only need alpha & beta though)
+    mdl = model.model(mesh, input_data, params, init_fields=False)
+
+    # Load alpha/beta fields
+    mdl.alpha_from_inversion()
+    mdl.beta_from_inversion()
+
+    # Regularization operator using inversion delta/gamma values
+    # TODO - this won't handle dual inversion case
+    if params.inversion.alpha_active:
+        delta = params.inversion.delta_alpha
+        gamma = params.inversion.gamma_alpha
+        cntrl = mdl.alpha
+    elif params.inversion.beta_active:
+        delta = params.inversion.delta_beta
+        gamma = params.inversion.gamma_beta
+        cntrl = mdl.beta
+
+    space = cntrl.function_space()
+
+    reg_op = prior.laplacian(delta, gamma, space,
+                             solver=params.prior.solver,
+                             rtol=params.prior.rtol,
+                             atol=params.prior.atol)
+
+    # The low rank update: eigenvalues above threshold & their eigenvectors
+    if sample_cfg.prior_only:
+        lam = np.zeros(0)
+        W = np.zeros((cntrl.vector().local_size(), 0))
+    else:
+        with open(os.path.join(outdir, params.io.eigenvalue_file), 'rb') as ff:
+            lam = pickle.load(ff)[0].real.astype(np.float64)
+
+        pind = np.flatnonzero(lam > params.eigendec.eigenvalue_thresh)
+        lam = lam[pind]
+        W = inout.MultiVectorFile(os.path.join(outdir, params.io.eigenvecs_file),
+                                  space).read(pind)
+
+    sampler = sample.PosteriorSampler(reg_op, lam, W, comm,
+                                      seed=sample_cfg.random_seed)
+
+    # Samples are centred on the MAP point & streamed to file per batch
+    cntrl_map = cntrl.vector().get_local()[:, None]
+    samples_out = inout.MultiVectorFile(os.path.join(outdir,
+                                                     params.io.samples_file),
+                                        space, 'w')
+
+    n_done = 0
+    while n_done < sample_cfg.n_samples:
+        k = min(sample_cfg.batch_size, sample_cfg.n_samples - n_done)
+        if sample_cfg.prior_only:
+            X = sampler.prior_samples(k)
+        else:
+            X = sampler.posterior_samples(k)
+
+        samples_out.append(cntrl_map + X)
+        n_done += k
+        log.info(f"Written {n_done} of {sample_cfg.n_samples} samples")
+
+    reg_op.log_stats()
+
+    return mdl
+
+
+if __name__ == "__main__":
+    stop_annotating()
+
+    assert len(sys.argv) == 2, "Expected a configuration file (*.toml)"
+    run_sample(sys.argv[1])
@@ -17,6 +17,8 @@
 
 from mpi4py import MPI
 import pytest
+import h5py
+import toml
 import numpy as np
 import fenics as fe
 import fenics_ice as fice
@@ -42,6 +44,41 @@ def test_parse_config(temp_model):
     assert params
     return params
 
+@pytest.mark.short
+def test_newton_cg_requires_prior():
+    """Newton-CG is preconditioned by the prior, so needs delta & gamma"""
+    config.InversionCfg(method="newton-cg", alpha_active=True, gtol=1e-6,
+                        delta_alpha=1e-5, gamma_alpha=1.0)
+
+    with pytest.raises(AssertionError):
+        config.InversionCfg(method="newton-cg", alpha_active=True, gtol=1e-6,
+                            delta_alpha=1e-5)
+
+@pytest.mark.short
+def test_multilevel_bc_files(mpi_tmpdir):
+    """Multilevel inversions of a case with BCs need a bc file per level"""
+    comm = MPI.COMM_WORLD
+    tmpdir = Path(mpi_tmpdir)
+    config_dict = toml.load(pytest.case_dir/"ice_stream"/"ice_stream.toml")
+    assert config_dict["mesh"]["bc_filename"] is not None
+
+    def parse(**inversion):
+        config_dict["inversion"].update(inversion)
+        toml_file = tmpdir/"multilevel.toml"
+        if comm.rank == 0:
+            (tmpdir/"input").mkdir(exist_ok=True)
+            with open(toml_file, 'w') as f:
+                toml.dump(config_dict, f)
+        comm.barrier()
+        return config.ConfigParser(toml_file, top_dir=tmpdir)
+
+    with pytest.raises(AssertionError):
+        parse(coarse_meshes=["coarse.xdmf"])
+
+    params = parse(coarse_meshes=["coarse.xdmf"],
+                   coarse_bc_files=["coarse_ff.xdmf"])
+    assert params.inversion.coarse_bc_files == ["coarse_ff.xdmf"]
+
 
 ###################
 #     INOUT       #
@@ -117,3 +154,83 @@ def test_input_data_read_and_interp(temp_model, monkeypatch):
     bad_space = fe.FunctionSpace(bad_mesh, 'Lagrange', 1)
     with pytest.raises(ValueError):
         indata.interpolate("bed", bad_space)
+
+@pytest.mark.short
+def test_time_series_writer(temp_model, monkeypatch):
+    """'h5' time series can be matched to the dofs via their coordinates"""
+    work_dir = temp_model["work_dir"]
+    monkeypatch.chdir(work_dir)
+
+    params = test_parse_config(temp_model)
+    object.__setattr__(params.io, "ts_output_format", "h5")
+    object.__setattr__(params.io, "ts_output_async", True)
+
+    mesh = fe.UnitSquareMesh(fe.MPI.comm_world, 4, 4)
+    H = fe.interpolate(fe.Expression("x[0] + 2.0 * x[1]", degree=1),
+                       fe.FunctionSpace(mesh, 'DG', 0))
+    U = fe.interpolate(fe.Expression(("x[0] + 2.0 * x[1]", "x[0] * x[1]"),
+                                     degree=2),
+                       fe.VectorFunctionSpace(mesh, 'Lagrange', 1))
+
+    ts_out = inout.TimeSeriesWriter(params, {"H": H, "U": U})
+    ts_out.write(0.0)
+    ts_out.write(1.0)
+    ts_out.close()
+
+    if MPI.COMM_WORLD.rank == 0:
+        filename = Path(params.io.output_dir) / f"{params.io.run_name}_ts.h5"
+        with h5py.File(filename, 'r') as f:
+            assert np.array_equal(f["t"][:], [0.0, 1.0])
+            assert f.attrs["num_procs"] == MPI.COMM_WORLD.size
+
+            x = f["dof_coords/H"][:, :]
+            assert np.allclose(f["H"][1, :], x[:, 0] + 2.0 * x[:, 1])
+
+            # Each dof of U is one of the two components at its coordinates
+            x = f["dof_coords/U"][:, :]
+            U_vals = f["U"][1, :]
+            assert np.all(np.isclose(U_vals, x[:, 0] + 2.0 * x[:, 1]) |
+                          np.isclose(U_vals, x[:, 0] * x[:, 1]))
+
+@pytest.mark.short
+def test_multivector_file(mpi_tmpdir):
+    """MultiVectorFile round trip, including remapping of permuted dofs"""
+    comm = MPI.COMM_WORLD
+    mesh = fe.UnitSquareMesh(fe.MPI.comm_world, 6, 6)
+    space = fe.FunctionSpace(mesh, 'Lagrange', 1)
+    filename = Path(mpi_tmpdir)/"vectors.h5"
+
+    n_local = fe.Function(space).vector().local_size()
+    rng = np.random.default_rng([1, comm.rank])
+    X = rng.standard_normal((n_local, 7))
+
+    mvf = inout.MultiVectorFile(filename, space, 'w')
+    mvf.append(X[:, :4])
+    mvf.append(X[:, 4:])
+    assert mvf.num_vectors() == 7
+
+    # Overwriting from an offset discards the later vectors
+    inout.MultiVectorFile(filename, space, 'a').append(X[:, 5:6], start=5)
+
+    def check_reads(mvf):
+        assert np.array_equal(mvf.read(), X[:, :6])
+        assert np.array_equal(mvf.read(slice(1, 4)), X[:, 1:4])
+        assert np.array_equal(mvf.read([2, 3, 4]), X[:, 2:5])
+        assert np.array_equal(mvf.read([5, 0, 3, 0]), X[:, [5, 0, 3, 0]])
+        assert mvf.read([]).shape == (n_local, 0)
+
+    mvf = inout.MultiVectorFile(filename, space)
+    assert mvf.num_vectors() == 6
+    check_reads(mvf)
+
+    # Permute the stored rows (as if written with a different partitioning)
+    if comm.rank == 0:
+        with h5py.File(filename, 'a') as f:
+            perm = np.random.default_rng(2).permutation(f["vectors"].shape[0])
+            f["vectors"][:, :] = f["vectors"][:, :][perm, :]
+            f["dof_coords"][:, :] = f["dof_coords"][:, :][perm, :]
+    comm.barrier()
+
+    mvf = inout.MultiVectorFile(filename, space)
+    check_reads(mvf)
+    assert not isinstance(mvf._rows, slice)
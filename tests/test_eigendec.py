@@ -0,0 +1,98 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+import scipy.linalg as sl
+from mpi4py import MPI as MPI4PY
+from fenics_ice.eigendec import block_inner, b_orthonormalize, randomized_ghep
+
+def local_rows(comm, n):
+    """Slice of the rows of a length n vector owned by this process"""
+    counts = [n // comm.size + (r < n % comm.size) for r in range(comm.size)]
+    start = sum(counts[:comm.rank])
+    return slice(start, start + counts[comm.rank])
+
+def block_op(comm, mat, own):
+    """Apply a (replicated) dense matrix to a distributed block"""
+    def action(X):
+        return mat[own].dot(np.concatenate(comm.allgather(X)))
+    return action
+
+def ghep_problem(n, lam):
+    """
+    Dense SPD B & symmetric A with A u = lam B u for the given leading
+    eigenvalues (the remainder being zero)
+    """
+    rng = np.random.default_rng(1)
+    C = rng.standard_normal((n, n))
+    B = np.eye(n) + 0.1 * C.dot(C.T) / n
+
+    # V^T B V = I
+    Q, _ = np.linalg.qr(rng.standard_normal((n, len(lam))))
+    V = sl.solve_triangular(sl.cholesky(B, lower=True), Q, lower=True,
+                            trans='T')
+    BV = B.dot(V)
+    A = (BV * lam).dot(BV.T)
+    return A, B
+
+@pytest.mark.short
+def test_b_orthonormalize():
+    """b_orthonormalize gives a B-orthonormal basis for the same space"""
+    comm = MPI4PY.COMM_WORLD
+    n, k = 60, 6
+    _, B = ghep_problem(n, np.ones(1))
+    own = local_rows(comm, n)
+
+    Y = np.random.default_rng(2).standard_normal((n, k))
+    Q, BQ = b_orthonormalize(comm, Y[own], block_op(comm, B, own))
+
+    assert np.allclose(block_inner(comm, Q, BQ), np.eye(k))
+    assert np.allclose(BQ, block_op(comm, B, own)(Q))
+
+    # Y = Q R with R upper triangular
+    R = block_inner(comm, Q, block_op(comm, B, own)(Y[own]))
+    assert np.allclose(np.tril(R, -1), 0.0)
+
+@pytest.mark.short
+def test_randomized_ghep():
+    """Compare randomized_ghep against scipy.linalg.eigh"""
+    comm = MPI4PY.COMM_WORLD
+    n, k = 80, 8
+    A, B = ghep_problem(n, 10.0 ** -np.arange(0.0, 8.0, 0.25))
+    own = local_rows(comm, n)
+
+    lam_ref, V_ref = sl.eigh(A, B)
+    lam_ref, V_ref = lam_ref[::-1][:k], V_ref[:, ::-1][:, :k]
+
+    B_inv = np.linalg.inv(B)
+    lam, W = randomized_ghep(comm,
+                             block_op(comm, A, own),
+                             block_op(comm, B, own),
+                             block_op(comm, B_inv, own),
+                             own.stop - own.start, k,
+                             n_oversample=10, power_iter=2)
+
+    assert np.allclose(lam, lam_ref, rtol=1.0e-6, atol=0.0)
+
+    # B-orthonormal, & equal to the reference eigenvectors up to sign
+    BW = block_op(comm, B, own)(W)
+    assert np.allclose(block_inner(comm, W, BW), np.eye(k), atol=1.0e-8)
+    overlap = block_inner(comm, BW, V_ref[own])
+    assert np.allclose(np.abs(overlap), np.eye(k), atol=1.0e-4)
@@ -19,11 +19,16 @@
 
 import pytest
 import os
+import shutil
+import toml
+from pathlib import Path
+from mpi4py import MPI as MPI4PY
 import numpy as np
 from fenics import *
 from tlm_adjoint import *
 import fenics_ice as fice
 from fenics_ice import model, config, inout, solver
+from fenics_ice import mesh as fice_mesh
 
 def init_model(model_dir, toml_file):
 
@@ -141,6 +146,131 @@ def test_gen_init_alpha(request, setup_deps, temp_model):
                               expected_init_alpha,
                               work_dir, 'expected_init_alpha')
 
+@pytest.mark.dependency()
+def test_mom_solver_reuse(request, setup_deps, temp_model):
+    """The momentum equation is reused until tlm_adjoint drops its references"""
+    setup_deps.set_case_dependency(request, ["test_gen_init_alpha"])
+
+    work_dir = temp_model["work_dir"]
+    toml_file = temp_model["toml_filename"]
+
+    mdl = init_model(work_dir, toml_file)
+    initialize_fields(mdl)
+    initialize_vel_obs(mdl)
+    mdl.gen_alpha()
+    mdl.bglen_from_data()
+    mdl.init_beta(mdl.bglen_to_beta(mdl.bglen), False)
+
+    slvr = solver.ssa_solver(mdl)
+    slvr.def_mom_eq()
+
+    reset_manager("memory")
+    start_manager()
+    slvr.solve_mom_eq()
+    mom_solver = slvr.mom_solver
+    slvr.solve_mom_eq()
+    assert slvr.mom_solver is mom_solver
+    stop_manager()
+
+    # Resetting the manager drops the references of the recorded equation
+    reset_manager()
+    assert mom_solver.references_dropped
+    slvr.solve_mom_eq()
+    assert slvr.mom_solver is not mom_solver
+    assert not slvr.mom_solver.references_dropped
+
+def test_bc_filename_per_level(mpi_tmpdir, monkeypatch):
+    """A model reads the boundary markers of its own (e.g. coarse) mesh"""
+    comm = MPI4PY.COMM_WORLD
+    tmpdir = Path(mpi_tmpdir)
+    case_dir = pytest.case_dir/"ice_stream"
+
+    # The ice stream mesh as its own 'coarse' level
+    config_dict = toml.load(case_dir/"ice_stream.toml")
+    config_dict["inversion"].update({"coarse_meshes": ["ice_stream.xdmf"],
+                                     "coarse_bc_files": ["coarse_ff.xdmf"]})
+    if comm.rank == 0:
+        shutil.copytree(case_dir/"input", tmpdir/"input", dirs_exist_ok=True)
+        for suffix in [".xdmf", ".h5"]:
+            shutil.copy(tmpdir/"input"/("ice_stream_ff" + suffix),
+                        tmpdir/"input"/("coarse_ff" + suffix))
+        with open(tmpdir/"multilevel.toml", 'w') as f:
+            toml.dump(config_dict, f)
+    comm.barrier()
+    monkeypatch.chdir(tmpdir)
+
+    params = config.ConfigParser("multilevel.toml", tmpdir)
+    indata = inout.InputData(params)
+    mesh = fice_mesh.get_mesh(params,
+                              mesh_filename=params.inversion.coarse_meshes[0])
+
+    mdl = model.model(mesh, indata, params,
+                      bc_filename=params.inversion.coarse_bc_files[0])
+    mdl_ref = model.model(mesh, indata, params)
+    assert np.array_equal(mdl.ff.array(), mdl_ref.ff.array())
+    assert np.any(mdl.ff.array() > 0)
+
+    # The per-level file is the one read
+    with pytest.raises(AssertionError):
+        model.model(mesh, indata, params, bc_filename="missing_ff.xdmf")
+
+@pytest.mark.short
+def test_inexact_krylov_rtol():
+    """Each momentum solver stage loosens its own Krylov tolerance"""
+    def newton_solver(**params):
+        return solver.MomentumNewtonSolver(
+            MPI.comm_world,
+            {'nonlinear_solver': 'newton', 'newton_solver': params})
+
+    lu = newton_solver()
+    gmres = newton_solver(linear_solver='gmres', preconditioner='ilu',
+                          krylov_solver={'relative_tolerance': 1.0e-8})
+    cg = newton_solver(linear_solver='cg', preconditioner='ilu',
+                       krylov_solver={'relative_tolerance': 1.0e-3})
+
+    assert lu.inexact_krylov_rtol(1.0, 1.0e-2) is None
+    assert np.isclose(gmres.inexact_krylov_rtol(0.1, 1.0e-2), 1.0e-3)
+    assert np.isclose(gmres.inexact_krylov_rtol(1.0e-9, 1.0e-2), 1.0e-8)
+    assert np.isclose(gmres.inexact_krylov_rtol(10.0, 1.0e-2), 1.0e-2)
+    # Never tighter than configured
+    assert np.isclose(cg.inexact_krylov_rtol(0.1, 1.0e-2), 1.0e-3)
+
+    cg.scale_tolerances(krylov_rtol=cg.inexact_krylov_rtol(1.0, 1.0e-1))
+    assert np.isclose(
+        cg.newton.parameters["krylov_solver"]["relative_tolerance"], 1.0e-1)
+    cg.scale_tolerances()
+    assert np.isclose(
+        cg.newton.parameters["krylov_solver"]["relative_tolerance"], 1.0e-3)
+
+@pytest.mark.short
+def test_locate_points():
+    """Compare locate_points against compute_first_entity_collision"""
+    mesh = UnitSquareMesh(MPI.comm_world, 10, 10)
+
+    # Random points, plus the mesh vertices (which lie on cell and
+    # partition boundaries)
+    rng = np.random.default_rng(0)
+    grid = np.linspace(0.0, 1.0, 11)
+    pts = np.concatenate((rng.uniform(0.0, 1.0, (200, 2)),
+                          np.stack(np.meshgrid(grid, grid), -1).reshape(-1, 2)))
+
+    cells, bary = fice_mesh.locate_points(mesh, pts)
+
+    # Each point is owned by exactly one process
+    n_owners = mesh.mpi_comm().allreduce((cells >= 0).astype(np.int64))
+    assert np.all(n_owners == 1)
+
+    bbox = mesh.bounding_box_tree()
+    for i in np.flatnonzero(cells >= 0):
+        verts = mesh.coordinates()[mesh.cells()[cells[i]]]
+        assert np.all(bary[i] >= -1e-10)
+        assert np.isclose(bary[i].sum(), 1.0)
+        assert np.allclose(bary[i].dot(verts), pts[i])
+
+        # Strictly interior points have a unique containing cell
+        if np.all(bary[i] > 1e-8):
+            assert bbox.compute_first_entity_collision(Point(*pts[i])) == cells[i]
+
 # Unused!
 def override_param(param_section, name, value):
     """Override frozen ConfigParser params for testing"""
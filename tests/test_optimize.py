@@ -0,0 +1,142 @@
+# For fenics_ice copyright information see ACKNOWLEDGEMENTS in the fenics_ice
+# root directory
+
+# This file is part of fenics_ice.
+#
+# fenics_ice is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# fenics_ice is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with tlm_adjoint.  If not, see <https://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+from fenics import *
+from tlm_adjoint_fenics import *
+from fenics_ice.optimize import LBFGSHistory, minimize_l_bfgs, EvalCache
+
+def quadratic_problem(n=20):
+    """
+    A control space, target & forward model for J(m) = 1/2 |m - m_ref|^2
+    (L2 norm), whose minimiser is m_ref
+    """
+    mesh = UnitIntervalMesh(MPI.comm_world, n)
+    space = FunctionSpace(mesh, "Lagrange", 1)
+    m_ref = interpolate(Expression("sin(3.0 * x[0]) + 2.0", degree=2), space)
+
+    def forward(m):
+        J = Functional(name="J")
+        J.assign(0.5 * inner(m - m_ref, m - m_ref) * dx)
+        return J
+
+    return space, m_ref, forward
+
+def global_vector(space, values):
+    """A Vector on space from an array of (global) dof values"""
+    x = Function(space).vector()
+    own_start, own_end = x.local_range()
+    x.set_local(values[own_start:own_end])
+    x.apply("insert")
+    return x
+
+@pytest.mark.short
+def test_lbfgs_history():
+    """Two-loop recursion against a known (diagonal) Hessian"""
+    space, _, _ = quadratic_problem()
+    N = space.dim()
+    d = np.arange(1.0, N + 1.0)
+
+    # Conjugate directions: after N pairs the inverse Hessian is exact
+    history = LBFGSHistory(m_max=N)
+    for i in range(N):
+        e_i = np.zeros(N)
+        e_i[i] = 1.0
+        history.append(global_vector(space, e_i),
+                       global_vector(space, d * e_i))
+    assert len(history) == N
+
+    g = np.random.default_rng(0).standard_normal(N)
+    Hg = history.inv_hessian_action(global_vector(space, g))
+    own_start, own_end = Hg.local_range()
+    assert np.allclose(Hg.get_local(), (g / d)[own_start:own_end])
+
+    # Pairs violating the curvature condition are skipped...
+    s = global_vector(space, np.ones(N))
+    history.append(s, -1.0 * s)
+    assert len(history) == N
+
+    # ...and only the m_max most recent are kept
+    history.append(s, 2.0 * s)
+    assert len(history) == N
+    assert history.pairs[-1][0] is s
+
+@pytest.mark.short
+def test_minimize_l_bfgs():
+    """L-BFGS finds the minimiser, & the history persists between calls"""
+    reset_manager("memory")
+
+    space, m_ref, forward = quadratic_problem()
+    m = Function(space, name="m")
+    history = LBFGSHistory(m_max=5)
+
+    n_calls = []
+    m, stats = minimize_l_bfgs(forward, m, history, maxiter=2, gtol=1.0e-12,
+                               callback=n_calls.append)
+    assert stats["n_iter"] == 2
+    assert n_calls == [1, 2]
+    assert len(history) == 2
+
+    m, stats = minimize_l_bfgs(forward, m, history, maxiter=50, gtol=1.0e-12)
+    assert stats["converged"]
+    assert 2 < len(history) <= 5
+    assert errornorm(m_ref, m) < 1.0e-8
+
+    stop_manager()
+
+@pytest.mark.short
+def test_eval_cache():
+    """Repeated points are served from the cache, least recently used evicted"""
+    reset_manager("memory")
+
+    space, m_ref, forward_J = quadratic_problem()
+    n_fwd = []
+    def forward(m):
+        n_fwd.append(1)
+        return forward_J(m)
+
+    m = Function(space, name="m")
+    cache = EvalCache(forward, m, size=2)
+
+    def evaluate_at(value):
+        m.vector()[:] = value
+        return cache.evaluate()
+
+    J_val, dJ = evaluate_at(1.0)
+    assert np.isclose(J_val, 0.5 * assemble((m - m_ref)**2 * dx))
+    dJ_ref = assemble(inner(TestFunction(space), m - m_ref) * dx)
+    assert np.allclose(dJ[0], dJ_ref.get_local())
+
+    evaluate_at(1.0)
+    assert (len(n_fwd), cache.n_hits) == (1, 1)
+
+    evaluate_at(2.0)
+    evaluate_at(1.0)
+    assert (len(n_fwd), cache.n_hits) == (2, 2)
+
+    # 2.0 is now the least recently used, so is evicted by 3.0
+    evaluate_at(3.0)
+    evaluate_at(1.0)
+    assert (len(n_fwd), cache.n_hits) == (3, 3)
+    evaluate_at(2.0)
+    assert (len(n_fwd), cache.n_hits) == (4, 3)
+    assert cache.n_requests == 7
+
+    stop_manager()
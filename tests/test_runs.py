@@ -17,10 +17,13 @@
 
 import pytest
 import numpy as np
+import h5py
+import toml
 from runs import run_inv, run_forward, run_eigendec, run_errorprop, run_invsigma
+from runs import run_ensemble, run_sample
 from tlm_adjoint import *
 from fenics import norm
-from fenics_ice import config
+from fenics_ice import config, inout
 from pathlib import Path
 from mpi4py import MPI
 
@@ -32,6 +35,22 @@ def EQReset():
     clear_caches()
     stop_manager()
 
+def toml_variant(toml_file, suffix, **sections):
+    """
+    Write a copy of toml_file (as <stem>_<suffix>.toml) with the given
+    sections updated, for testing run options. Returns the new filename.
+    """
+    config_dict = toml.load(toml_file)
+    for name, values in sections.items():
+        config_dict.setdefault(name, {}).update(values)
+
+    new_file = Path(toml_file).with_name(f"{Path(toml_file).stem}_{suffix}.toml")
+    if MPI.COMM_WORLD.rank == 0:
+        with open(new_file, 'w') as f:
+            toml.dump(config_dict, f)
+    MPI.COMM_WORLD.barrier()
+    return new_file
+
 @pytest.mark.dependency()
 @pytest.mark.runs
 def test_run_inversion(persistent_temp_model, monkeypatch):
@@ -65,6 +84,50 @@ def test_run_inversion(persistent_temp_model, monkeypatch):
                               expected_J_inv,
                               work_dir, 'expected_J_inv')
 
+@pytest.mark.dependency()
+@pytest.mark.runs
+def test_run_inversion_resume(existing_temp_model, monkeypatch, setup_deps,
+                              request):
+    """Resuming from a checkpoint reproduces an uninterrupted inversion"""
+    setup_deps.set_case_dependency(request, ["test_run_inversion"])
+
+    work_dir = existing_temp_model["work_dir"]
+    toml_file = existing_temp_model["toml_filename"]
+
+    # Switch to the working directory
+    monkeypatch.chdir(work_dir)
+
+    # Separate run_name, so as not to overwrite the test_run_inversion output
+    def inversion(max_iter, resume=False):
+        inv_toml = toml_variant(toml_file, "resume",
+                                io={"run_name": "resume_test"},
+                                inversion={"max_iter": max_iter,
+                                           "checkpoint": True,
+                                           "keep_lbfgs_history": True})
+        EQReset()
+        mdl_out = run_inv.run_inv(inv_toml, resume=resume)
+        cntrl = mdl_out.solvers[0].get_control()[0]
+        return norm(cntrl.vector()), inv_toml
+
+    cntrl_norm, _ = inversion(6)
+
+    # Stop after 3 iterations, then mark the final checkpoint as part way
+    # through the (single) alternation, as if the run had been interrupted
+    _, inv_toml = inversion(3)
+    params = config.ConfigParser(inv_toml, top_dir=work_dir)
+    ckpt_file = Path(params.io.output_dir) / params.io.inv_checkpoint_file
+    if MPI.COMM_WORLD.rank == 0:
+        with h5py.File(ckpt_file, 'a') as f:
+            assert f.attrs["alt"] == 1
+            f.attrs["alt"] = 0
+            f.attrs["n_iter"] = 3
+    MPI.COMM_WORLD.barrier()
+
+    cntrl_norm_resumed, _ = inversion(6, resume=True)
+
+    assert np.isclose(cntrl_norm_resumed, cntrl_norm, rtol=1e-6, atol=0.0)
+
+
 @pytest.mark.dependency()
 @pytest.mark.runs
 def test_run_forward(existing_temp_model, monkeypatch, setup_deps, request):
@@ -100,6 +163,69 @@ def test_run_forward(existing_temp_model, monkeypatch, setup_deps, request):
                               work_dir, 'expected_u_norm')
 
 
+@pytest.mark.dependency()
+@pytest.mark.runs
+def test_run_forward_only(existing_temp_model, monkeypatch, setup_deps, request):
+    """The unannotated forward run reproduces the QoI of run_forward"""
+    setup_deps.set_case_dependency(request, ["test_run_inversion"])
+
+    work_dir = existing_temp_model["work_dir"]
+    toml_file = existing_temp_model["toml_filename"]
+
+    # Switch to the working directory
+    monkeypatch.chdir(work_dir)
+
+    # Get expected values from the toml file
+    params = config.ConfigParser(toml_file, top_dir=work_dir)
+    expected_delta_qoi = params.testing.expected_delta_qoi
+
+    EQReset()
+
+    mdl_out = run_forward.run_forward(toml_file, forward_only=True)
+
+    slvr = mdl_out.solvers[0]
+    delta_qoi = slvr.Qval_ts[-1] - slvr.Qval_ts[0]
+
+    pytest.check_float_result(delta_qoi,
+                              expected_delta_qoi,
+                              work_dir, 'expected_delta_qoi')
+
+
+@pytest.mark.dependency()
+@pytest.mark.runs
+def test_run_ensemble(existing_temp_model, monkeypatch, setup_deps, request):
+    """An unperturbed ensemble member reproduces the QoI of run_forward"""
+    setup_deps.set_case_dependency(request, ["test_run_inversion"])
+
+    work_dir = existing_temp_model["work_dir"]
+    toml_file = existing_temp_model["toml_filename"]
+
+    # Switch to the working directory
+    monkeypatch.chdir(work_dir)
+
+    # Two members: unperturbed & with doubled smb
+    ens_toml = toml_variant(toml_file, "ensemble",
+                            ensemble={"smb_scale": [1.0, 2.0]})
+
+    params = config.ConfigParser(ens_toml, top_dir=work_dir)
+    expected_delta_qoi = params.testing.expected_delta_qoi
+
+    EQReset()
+
+    run_ensemble.run_ensemble(ens_toml)
+
+    with h5py.File(Path(params.io.output_dir) / params.io.ensemble_file,
+                   'r') as f:
+        Qval = f["Qval"][:, :]
+
+    assert Qval.shape == (2, params.time.total_steps + 1)
+    assert not np.allclose(Qval[0], Qval[1])
+
+    pytest.check_float_result(Qval[0, -1] - Qval[0, 0],
+                              expected_delta_qoi,
+                              work_dir, 'expected_delta_qoi')
+
+
 @pytest.mark.dependency()
 @pytest.mark.runs
 def test_run_eigendec(existing_temp_model, monkeypatch, setup_deps, request):
@@ -133,6 +259,43 @@ def test_run_eigendec(existing_temp_model, monkeypatch, setup_deps, request):
                               expected_evec0_norm,
                               work_dir, 'expected_evec0_norm')
 
+@pytest.mark.dependency()
+@pytest.mark.runs
+def test_run_sample(existing_temp_model, monkeypatch, setup_deps, request):
+    """Posterior samples are written in batches, centred on the MAP point"""
+    setup_deps.set_case_dependency(request, ["test_run_eigendec"])
+
+    work_dir = existing_temp_model["work_dir"]
+    toml_file = existing_temp_model["toml_filename"]
+
+    # Switch to the working directory
+    monkeypatch.chdir(work_dir)
+
+    # An incomplete final batch
+    sample_toml = toml_variant(toml_file, "sample",
+                               sample={"n_samples": 5, "batch_size": 2})
+    params = config.ConfigParser(sample_toml, top_dir=work_dir)
+
+    EQReset()
+
+    mdl_out = run_sample.run_sample(sample_toml)
+
+    cntrl = mdl_out.alpha if params.inversion.alpha_active else mdl_out.beta
+    samples = inout.MultiVectorFile(Path(params.io.output_dir) /
+                                    params.io.samples_file,
+                                    cntrl.function_space())
+    X = samples.read()
+
+    assert X.shape[1] == 5
+    assert np.all(np.isfinite(X))
+
+    # Each sample is a distinct perturbation of the MAP point
+    dX = X - cntrl.vector().get_local()[:, None]
+    dX_norm = MPI.COMM_WORLD.allreduce(np.sum(dX**2, axis=0))
+    assert np.all(dX_norm > 0.0)
+    assert len(np.unique(dX_norm)) == 5
+
+
 @pytest.mark.dependency()
 @pytest.mark.runs
 def test_run_errorprop(existing_temp_model, monkeypatch, setup_deps, request):